@@ -16,8 +16,14 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-from xbmcswift2 import Plugin, xbmc
-from resources.lib.api import RadioApi, RadioApiError
+import os
+import time
+from functools import wraps
+from itertools import islice
+
+from xbmcswift2 import Plugin, xbmc, xbmcgui
+from resources.lib.errors import RadioApiError
+from resources.lib.metrics import Metrics
 
 STRINGS = {
     'editorials_recommendations': 30100,
@@ -29,6 +35,7 @@ STRINGS = {
     'browse_by_language': 30106,
     'local_stations': 30107,
     'my_stations': 30108,
+    'next_page': 30109,
     'search_for_station': 30200,
     'enter_name_country_or_language': 30201,
     'add_to_my_stations': 30400,
@@ -38,16 +45,89 @@ STRINGS = {
     'name': 30501,
     'thumbnail': 30502,
     'stream_url': 30503,
-    'add_custom': 30504
+    'add_custom': 30504,
+    'network_error': 30600,
 }
 
+PREFETCH_COUNT = 10
+PREFETCH_TIMEOUT = 10
+HOME_WINDOW = 10000
+
 
 plugin = Plugin()
-radio_api = RadioApi()
-my_stations = plugin.get_storage('my_stations.json', file_format='json')
+metrics = Metrics(os.path.join(plugin.storage_path, 'metrics'),
+                  enabled=plugin.get_setting('enable_metrics', bool))
+
+
+def __lazy(factory):
+    # Kodi starts a new interpreter for every call of the plugin, so the
+    # api client and the storages are only imported and built by the
+    # routes which really need them
+    instances = []
+
+    @wraps(factory)
+    def get_instance():
+        if not instances:
+            instances.append(factory())
+        return instances[0]
+    get_instance.is_loaded = lambda: bool(instances)
+    return get_instance
+
+
+def __get_cache(table):
+    from resources.lib.cache import Cache
+    return Cache(os.path.join(plugin.storage_path, 'api_cache.db'),
+                 table=table)
+
+
+@__lazy
+def radio_api():
+    from resources.lib.api import RadioApi
+    api = RadioApi(cache=__get_cache('cache'), metrics=metrics)
+    api.prober.store = __get_cache('hosts')
+    api.set_language(__get_language())
+    api.set_timeout(plugin.get_setting('network_timeout', int))
+    api.probe_servers = plugin.get_setting('probe_servers', bool)
+    api.log = __log
+    from resources.lib.flight import SingleFlight
+    api.single_flight = SingleFlight(
+        os.path.join(plugin.storage_path, 'flights'),
+        __get_cache('flights'), metrics
+    )
+    from resources.lib.breaker import CircuitBreaker
+    api.breaker = CircuitBreaker(__get_cache('breakers'))
+    return api
+
+
+@__lazy
+def multi_language_api():
+    from resources.lib.multilang import MultiLanguageApi
+    return MultiLanguageApi(radio_api())
+
+
+@__lazy
+def prefetcher():
+    from resources.lib.prefetch import StreamPrefetcher
+    return StreamPrefetcher(radio_api(), __get_cache('streams'))
+
+
+@__lazy
+def my_stations():
+    from resources.lib.favourites import MyStations
+    return MyStations(
+        os.path.join(plugin.storage_path, 'my_stations.db'),
+        legacy_path=os.path.join(plugin.storage_path, 'my_stations.json'),
+    )
+
+
+@__lazy
+def item_renderer():
+    from resources.lib.render import ItemRenderer
+    return ItemRenderer(plugin.url_for, _)
 
 
 @plugin.route('/')
+@metrics.timed('route')
 def show_root_menu():
     items = (
         {'label': _('local_stations'),
@@ -80,24 +160,34 @@ def show_root_menu():
 
 
 @plugin.route('/stations/local/')
+@metrics.timed('route')
 def show_local_stations():
-    stations = radio_api.get_local_stations()
+    stations = radio_api().get_local_stations()
     return __add_stations(stations)
 
 
 @plugin.route('/stations/recommended/')
+@metrics.timed('route')
 def show_recommendation_stations():
-    stations = radio_api.get_recommendation_stations()
+    if plugin.get_setting('merge_languages', bool):
+        stations = multi_language_api().get_recommendation_stations()
+    else:
+        stations = radio_api().get_recommendation_stations()
     return __add_stations(stations)
 
 
 @plugin.route('/stations/top/')
+@metrics.timed('route')
 def show_top_stations():
-    stations = radio_api.get_top_stations()
+    if plugin.get_setting('merge_languages', bool):
+        stations = multi_language_api().get_top_stations()
+    else:
+        stations = radio_api().get_top_stations()
     return __add_stations(stations)
 
 
 @plugin.route('/stations/search/')
+@metrics.timed('route')
 def search():
     query = plugin.keyboard(heading=_('enter_name_country_or_language'))
     if query:
@@ -105,25 +195,58 @@ def search():
         plugin.redirect(url)
 
 
-@plugin.route('/stations/search/<search_string>/')
-def search_result(search_string):
-    stations = radio_api.search_stations_by_string(search_string)
-    return __add_stations(stations)
+@plugin.route('/stations/search/<search_string>/', options={'page': '1'})
+@plugin.route('/stations/search/<search_string>/page/<page>/',
+              name='search_result_page')
+@metrics.timed('route')
+def search_result(search_string, page):
+    page, page_size = int(page), __get_page_size()
+    # the index is harvested by the service
+    station_index = __get_station_index()
+    if (plugin.get_setting('local_search', bool) and
+            station_index.is_fresh()):
+        __log('search_result using the local station index')
+        stations = station_index.search(search_string)
+        start = (page - 1) * page_size
+        has_next = len(stations) > start + page_size
+        stations = stations[start:start + page_size]
+    else:
+        stations, has_next = radio_api().search_stations_by_string_page(
+            search_string, page, page_size
+        )
+    next_page_url = None
+    if has_next:
+        next_page_url = plugin.url_for('search_result_page',
+                                       search_string=search_string,
+                                       page=str(page + 1))
+    return __add_stations(stations, next_page_url=next_page_url,
+                          offset=(page - 1) * page_size)
 
 
 @plugin.route('/stations/my/')
+@metrics.timed('route')
 def show_my_stations():
-    stations = my_stations.values()
+    stations = my_stations().values()
+    station_ids = [
+        station['id'] for station in stations
+        if not station.get('is_custom', False)
+    ]
+    if station_ids:
+        stations = __refresh_my_stations(stations, station_ids)
+    # the service polls the current tracks of the favourites for a while
+    xbmcgui.Window(HOME_WINDOW).setProperty(
+        '%s.my_stations_listed' % plugin.id, str(int(time.time()))
+    )
     return __add_stations(stations, add_custom=True)
 
 
 @plugin.route('/stations/my/custom/<station_id>')
+@metrics.timed('route')
 def custom_my_station(station_id):
     if station_id == 'new':
         station = {}
     else:
-        stations = my_stations.values()
-        station = [s for s in stations if s['id'] == station_id][0]
+        station = my_stations()[station_id]
     for param in ('name', 'thumbnail', 'stream_url'):
         heading = _('please_enter') % _(param)
         station[param] = plugin.keyboard(station.get(param, ''), heading) or ''
@@ -132,28 +255,30 @@ def custom_my_station(station_id):
     station['id'] = station_id
     station['is_custom'] = '1'
     if station_id:
-        my_stations[station_id] = station
+        my_stations()[station_id] = station
         url = plugin.url_for('show_my_stations')
         plugin.redirect(url)
 
 
 @plugin.route('/stations/my/add/<station_id>')
+@metrics.timed('route')
 def add_to_my_stations(station_id):
-    station = radio_api.get_station_by_station_id(station_id)
-    my_stations[station_id] = station
-    my_stations.sync()
+    station = radio_api().get_station_by_station_id(station_id)
+    prefetcher().store(station_id, station['stream_url'])
+    my_stations()[station_id] = station
 
 
 @plugin.route('/stations/my/del/<station_id>')
+@metrics.timed('route')
 def del_from_my_stations(station_id):
-    if station_id in my_stations:
-        del my_stations[station_id]
-        my_stations.sync()
+    if station_id in my_stations():
+        del my_stations()[station_id]
 
 
 @plugin.route('/stations/<category_type>/')
+@metrics.timed('route')
 def show_station_categories(category_type):
-    categories = radio_api.get_categories(category_type)
+    categories = radio_api().get_categories(category_type)
     items = []
     for category in categories:
         category = category.encode('utf-8')
@@ -168,71 +293,65 @@ def show_station_categories(category_type):
     return plugin.finish(items)
 
 
-@plugin.route('/stations/<category_type>/<category>/')
-def show_stations_by_category(category_type, category):
-    stations = radio_api.get_stations_by_category(category_type,
-                                                  category)
-    return __add_stations(stations)
+@plugin.route('/stations/<category_type>/<category>/', options={'page': '1'})
+@plugin.route('/stations/<category_type>/<category>/page/<page>/',
+              name='show_stations_by_category_page')
+@metrics.timed('route')
+def show_stations_by_category(category_type, category, page):
+    page, page_size = int(page), __get_page_size()
+    if page == 1 and plugin.get_setting('background_sync', bool):
+        __get_catalogue_sync().record_visit(category_type, category)
+    stations, has_next = radio_api().get_stations_by_category_page(
+        category_type, category, page, page_size
+    )
+    next_page_url = None
+    if has_next:
+        next_page_url = plugin.url_for('show_stations_by_category_page',
+                                       category_type=category_type,
+                                       category=category,
+                                       page=str(page + 1))
+    return __add_stations(stations, next_page_url=next_page_url,
+                          offset=(page - 1) * page_size)
 
 
 @plugin.route('/station/<station_id>')
+@metrics.timed('route')
 def get_stream_url(station_id):
-    if my_stations.get(station_id, {}).get('is_custom', False):
-        stream_url = my_stations[station_id]['stream_url']
-    else:
-        station = radio_api.get_station_by_station_id(station_id)
+    station = my_stations().get(station_id, {})
+    if station.get('is_custom', False):
         stream_url = station['stream_url']
+    else:
+        stream_url = prefetcher().get_stream_url(station_id)
+    # lets the service poll the current track of the playing station
+    window = xbmcgui.Window(HOME_WINDOW)
+    window.setProperty('%s.active_station' % plugin.id, station_id)
+    window.setProperty('%s.active_url' % plugin.id, stream_url)
     __log('get_stream_url result: %s' % stream_url)
     return plugin.set_resolved_url(stream_url)
 
 
-def __add_stations(stations, add_custom=False):
-    __log('__add_stations started with %d items' % len(stations))
-    items = []
-    my_station_ids = my_stations.keys()
-    for i, station in enumerate(stations):
-        station_id = str(station['id'])
-        if not station_id in my_station_ids:
-            context_menu = [(
-                _('add_to_my_stations'),
-                'XBMC.RunPlugin(%s)' % plugin.url_for('add_to_my_stations',
-                                                      station_id=station_id),
-            )]
-        else:
-            context_menu = [(
-                _('remove_from_my_stations'),
-                'XBMC.RunPlugin(%s)' % plugin.url_for('del_from_my_stations',
-                                                      station_id=station_id),
-            )]
-        if station.get('is_custom', False):
-            context_menu.append((
-                _('edit_custom_station'),
-                'XBMC.RunPlugin(%s)' % plugin.url_for('custom_my_station',
-                                                      station_id=station_id),
-            ))
-        items.append({
-            'label': station.get('name', ''),
-            'thumbnail': station['thumbnail'],
-            'info': {
-                'title': station.get('name', ''),
-                'rating': str(station.get('rating', '0.0')),
-                'genre': station.get('genre', ''),
-                'size': int(station.get('bitrate', 0)),
-                'comment': station.get('current_track', ''),
-                'count': i,
-            },
-            'context_menu': context_menu,
-            'path': plugin.url_for(
-                'get_stream_url',
-                station_id=station_id,
-            ),
-            'is_playable': True,
-        })
+@metrics.timed('add_stations')
+def __add_stations(stations, add_custom=False, next_page_url=None,
+                   offset=0):
+    stations = list(stations)
+    thumbnails = {}
+    if plugin.get_setting('cache_artwork', bool):
+        thumbnails = __get_artwork_cache().get_paths(
+            station.get('thumbnail') for station in stations
+        )
+    items = item_renderer().render(stations, set(my_stations().keys()),
+                                   thumbnails, offset)
+    __log('__add_stations added %d items' % len(items))
     if add_custom:
         items.append({
             'label': _('add_custom'),
             'path': plugin.url_for('custom_my_station', station_id='new'),
         })
+    if next_page_url:
+        items.append({
+            'label': _('next_page'),
+            'path': next_page_url,
+        })
     finish_kwargs = {
         'sort_methods': [
             ('UNSORTED', '%X'),
@@ -242,9 +361,71 @@ def __add_stations(stations, add_custom=False):
     }
     if plugin.get_setting('force_viewmode', bool):
         finish_kwargs['view_mode'] = 'thumbnail'
+    if plugin.get_setting('prefetch_streams', bool):
+        __prefetch_stream_urls(list(islice(
+            (str(station['id']) for station in stations
+             if not station.get('is_custom')),
+            PREFETCH_COUNT
+        )))
     return plugin.finish(items, **finish_kwargs)
 
 
+def __refresh_my_stations(stations, station_ids):
+    # current track, rating and bitrate change, the stored stream url is
+    # kept since it is resolved already
+    fresh_stations = dict(
+        (str(station['id']), station)
+        for station in radio_api().get_stations_by_ids(station_ids)
+    )
+    __log('__refresh_my_stations refreshed %d of %d stations'
+          % (len(fresh_stations), len(station_ids)))
+    refreshed = []
+    changed = {}
+    for station in stations:
+        station_id = str(station['id'])
+        if station_id in fresh_stations:
+            fresh_station = dict(fresh_stations[station_id])
+            fresh_station['stream_url'] = station.get('stream_url', '')
+            if fresh_station != station:
+                changed[station_id] = fresh_station
+            station = fresh_station
+        refreshed.append(station)
+    if changed:
+        my_stations().update(changed)
+    return refreshed
+
+
+def __prefetch_stream_urls(station_ids):
+    station_ids.extend(
+        station_id for station_id, station in my_stations().items()
+        if not station.get('is_custom', False)
+    )
+    queued = prefetcher().prefetch(station_ids)
+    __log('__prefetch_stream_urls queued %d stations' % queued)
+
+
+def __get_page_size():
+    from resources.lib.api import RadioApi
+    return plugin.get_setting('stations_per_page', int) or RadioApi.PAGE_SIZE
+
+
+def __get_station_index():
+    from resources.lib.index import StationIndex
+    return StationIndex(os.path.join(
+        plugin.storage_path, 'stations_%s.db' % radio_api().language
+    ))
+
+
+def __get_artwork_cache():
+    from resources.lib.artwork import ArtworkCache
+    return ArtworkCache(os.path.join(plugin.storage_path, 'artwork'))
+
+
+def __get_catalogue_sync():
+    from resources.lib.sync import CatalogueSync
+    return CatalogueSync(radio_api(), __get_cache('visits'))
+
+
 def __get_language():
     languages = ('english', 'german', 'french')
     if not plugin.get_setting('not_first_run', str):
@@ -272,9 +453,10 @@ def _(string_id):
         return string_id
 
 if __name__ == '__main__':
-    radio_api.set_language(__get_language())
-    radio_api.log = __log
     try:
         plugin.run()
     except RadioApiError:
         plugin.notify(msg=_('network_error'))
+    if prefetcher.is_loaded():
+        prefetcher().wait(PREFETCH_TIMEOUT)
+    metrics.flush()
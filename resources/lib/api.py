@@ -17,13 +17,19 @@
 #    along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 import json
+from itertools import islice
+from Queue import Queue, Empty
 from urllib import urlencode
-from urllib2 import urlopen, Request, HTTPError, URLError
+from urlparse import urlsplit
 import random
+import threading
+import time
 
-
-class RadioApiError(Exception):
-    pass
+from errors import (RadioApiError, HTTPStatusError, StationError,
+                    TransportError, TransportTimeoutError)
+from metrics import Metrics
+from probe import ServerProber
+from station import Station
 
 
 class RadioApi():
@@ -40,35 +46,85 @@ class RadioApi():
 
     USER_AGENT = 'XBMC Addon Radio'
 
-    PLAYLIST_PREFIXES = ('m3u', 'pls', 'asx', 'xml')
+    PLAYLIST_PREFIXES = ('m3u', 'pls', 'asx', 'xspf', 'xml')
+
+    CACHE_TTLS = {
+        'categories': 12 * 60 * 60,
+        'stations': 60 * 60,
+        'top': 10 * 60,
+        'station': 0,
+        'station_info': 5 * 60,
+    }
+
+    TIMEOUT = 10
+
+    PAGE_SIZE = 100
 
-    def __init__(self, language='english', user_agent=USER_AGENT):
+    MAX_WORKERS = 4
+
+    # failed api requests are repeated after a random delay of up to
+    # RETRY_BACKOFF * 2 ** attempt seconds, timeouts are not repeated
+    RETRIES = 2
+    RETRY_BACKOFF = 0.5
+    # station lookups are bounded by their worker pools already, a shared
+    # rate limit would starve the favourites refresh and the prefetch
+    UNLIMITED_PATHS = ('broadcast/getbroadcastembedded', )
+    # a redirect (HEAD and GET) and nested playlists of a station
+    MAX_STREAM_REQUESTS = 5
+
+    # broadcasts are reduced to these fields while they are decoded, the
+    # stream urls are read by __resolve_playlist
+    STATION_FIELDS = Station.API_FIELDS + ('streamUrls', )
+
+    def __init__(self, language='english', user_agent=USER_AGENT, cache=None,
+                 transport=None, probe_servers=False, metrics=None):
         self.set_language(language)
         self.user_agent = user_agent
+        self.cache = cache
+        # the http stack is only imported once a request is made
+        self.transport = transport
+        self.timeout = RadioApi.TIMEOUT
+        self.probe_servers = probe_servers
+        # cached responses expiring within this many seconds are refetched
+        self.refresh_ahead = 0
+        # optional SingleFlight shared by identical concurrent calls
+        self.single_flight = None
+        # optional CircuitBreaker in front of the api requests
+        self.breaker = None
+        self.prober = ServerProber(transport)
+        self.metrics = metrics or Metrics()
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+        if self.transport is not None:
+            self.transport.timeout = timeout
 
     def set_language(self, language):
         if not language in RadioApi.MAIN_URLS.keys():
             raise ValueError('Invalid language')
+        self.language = language
         self.api_url = RadioApi.MAIN_URLS[language]
 
     def get_recommendation_stations(self):
         self.log('get_recommendation_stations started')
         path = 'broadcast/editorialreccomendationsembedded'
-        stations = self.__api_call(path)
-        return self.__format_stations(stations)
+        stations = self.__api_call(path, ttl=RadioApi.CACHE_TTLS['top'])
+        return list(self.__format_stations(stations))
 
     def get_top_stations(self):
         self.log('get_top_stations started')
         path = 'menu/broadcastsofcategory'
         param = {'category': '_top'}
-        stations = self.__api_call(path, param)
-        return self.__format_stations(stations)
+        stations = self.__api_call(path, param, RadioApi.CACHE_TTLS['top'])
+        return list(self.__format_stations(stations))
 
     def get_local_stations(self, num_entries=25):
         self.log('get_local_stations started with num_entries=%d'
                  % num_entries)
         most_wanted_stations = self._get_most_wanted(num_entries)
-        return self.__format_stations(most_wanted_stations['localBroadcasts'])
+        return list(self.__format_stations(
+            most_wanted_stations['localBroadcasts']
+        ))
 
     def get_category_types(self):
         self.log('get_category_types started')
@@ -81,48 +137,103 @@ class RadioApi():
             raise ValueError('Bad category_type')
         path = 'menu/valuesofcategory'
         param = {'category': '_%s' % category_type}
-        categories = self.__api_call(path, param)
+        categories = self.__api_call(path, param,
+                                     RadioApi.CACHE_TTLS['categories'])
         return categories
 
     def get_stations_by_category(self, category_type, category_value):
         self.log(('get_stations_by_category started with category_type=%s, '
                   'category_value=%s') % (category_type, category_value))
-        if not category_type in self.get_category_types():
-            raise ValueError('Bad category_type')
-        path = 'menu/broadcastsofcategory'
-        param = {
-            'category': '_%s' % category_type,
-            'value': category_value,
-        }
-        stations = self.__api_call(path, param)
-        return self.__format_stations(stations)
+        stations = self.__get_category_stations(category_type, category_value)
+        return list(self.__format_stations(stations))
+
+    def get_stations_by_category_page(self, category_type, category_value,
+                                      page=1, page_size=PAGE_SIZE):
+        self.log(('get_stations_by_category_page started with '
+                  'category_type=%s, category_value=%s, page=%d')
+                 % (category_type, category_value, page))
+        stations = self.__get_category_stations(category_type, category_value)
+        # the api has no paging here, the full list is cached instead
+        start = (page - 1) * page_size
+        has_next = len(stations) > start + page_size
+        page_stations = islice(stations, start, start + page_size)
+        return self.__format_stations(page_stations), has_next
 
     def search_stations_by_string(self, search_string):
         self.log('search_stations_by_string started with search_string=%s'
                  % search_string)
-        path = 'index/searchembeddedbroadcast'
-        param = {
-            'q': search_string,
-            'start': '0',
-            'rows': '10000',
-            'streamcontentformats': 'aac,mp3',
-        }
-        stations = self.__api_call(path, param)
-        return self.__format_stations(stations)
+        stations = self.__search_stations(search_string, 0, 10000)
+        return list(self.__format_stations(stations))
+
+    def search_stations_by_string_page(self, search_string, page=1,
+                                       page_size=PAGE_SIZE):
+        self.log(('search_stations_by_string_page started with '
+                  'search_string=%s, page=%d') % (search_string, page))
+        # one more row than needed tells if there is a next page
+        stations = self.__search_stations(search_string,
+                                          (page - 1) * page_size,
+                                          page_size + 1)
+        has_next = len(stations) > page_size
+        page_stations = islice(stations, page_size)
+        return self.__format_stations(page_stations), has_next
 
     def get_station_by_station_id(self, station_id, resolve_playlists=True):
         self.log('get_station_by_station_id started with station_id=%s'
                  % station_id)
-        path = 'broadcast/getbroadcastembedded'
-        param = {'broadcast': str(station_id)}
-        station = self.__api_call(path, param)
-        if self.__check_redirect(station['streamURL']):
-            station['streamURL'] = self.__follow_redirect(station['streamURL'])
-        if resolve_playlists and self.__check_paylist(station['streamURL']):
-            playlist_url = station['streamURL']
-            station['streamURL'] = self.__resolve_playlist(station)
+        if self.single_flight is None:
+            station = self.__get_station(station_id, resolve_playlists)
+        else:
+            # the redirect and playlist requests are not repeated
+            station = self.single_flight.do(
+                json.dumps([self.api_url, 'station', str(station_id),
+                            resolve_playlists]),
+                lambda: self.__get_station(station_id, resolve_playlists),
+                'get_station_by_station_id',
+                self.__max_call_time(RadioApi.MAX_STREAM_REQUESTS) +
+                self.prober.TIMEOUT
+            )
         stations = (station, )
-        return self.__format_stations(stations)[0]
+        return next(self.__format_stations(stations))
+
+    def get_stations_by_ids(self, station_ids, timeout=None):
+        self.log('get_stations_by_ids started with %d station_ids'
+                 % len(station_ids))
+        # metadata only, the stream urls are not resolved
+        station_ids = [str(station_id) for station_id in station_ids]
+        queue = Queue()
+        for station_id in station_ids:
+            queue.put(station_id)
+        results = {}
+        threads = []
+        for i in xrange(min(RadioApi.MAX_WORKERS, len(station_ids))):
+            thread = threading.Thread(target=self.__fetch_stations,
+                                      args=(queue, results))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        deadline = time.time() + (timeout or self.timeout)
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+        # stations not fetched in time are left out
+        while True:
+            try:
+                queue.get_nowait()
+            except Empty:
+                break
+        results = dict(results)
+        return [
+            results[station_id] for station_id in station_ids
+            if station_id in results
+        ]
+
+    def check_stream_url(self, stream_url, timeout=None):
+        self.log('check_stream_url started with stream_url=%s' % stream_url)
+        try:
+            self.__request_headers(stream_url, timeout)
+        except TransportError, error:
+            self.log('check_stream_url error: %s' % error)
+            return False
+        return True
 
     def _get_most_wanted(self, num_entries=25):
         self.log('get_most_wanted started with num_entries=%d'
@@ -131,17 +242,105 @@ class RadioApi():
             raise TypeError('Need int')
         path = 'account/getmostwantedbroadcastlists'
         param = {'sizeoflists': str(num_entries)}
-        stations_lists = self.__api_call(path, param)
+        stations_lists = self.__api_call(path, param,
+                                         RadioApi.CACHE_TTLS['top'])
         return stations_lists
 
-    def __api_call(self, path, param=None):
+    def __get_category_stations(self, category_type, category_value):
+        if not category_type in self.get_category_types():
+            raise ValueError('Bad category_type')
+        path = 'menu/broadcastsofcategory'
+        param = {
+            'category': '_%s' % category_type,
+            'value': category_value,
+        }
+        return self.__api_call(path, param, RadioApi.CACHE_TTLS['stations'])
+
+    def __search_stations(self, search_string, start, rows):
+        path = 'index/searchembeddedbroadcast'
+        param = {
+            'q': search_string,
+            'start': str(start),
+            'rows': str(rows),
+            'streamcontentformats': 'aac,mp3',
+        }
+        return self.__api_call(path, param, RadioApi.CACHE_TTLS['top'])
+
+    def __fetch_stations(self, queue, results):
+        path = 'broadcast/getbroadcastembedded'
+        while True:
+            try:
+                station_id = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                station = self.__api_call(path, {'broadcast': station_id},
+                                          RadioApi.CACHE_TTLS['station_info'])
+            except RadioApiError, error:
+                self.log('__fetch_stations failed for station_id=%s: %s'
+                         % (station_id, error))
+                continue
+            results[station_id] = next(self.__format_stations((station, )))
+
+    def __get_station(self, station_id, resolve_playlists):
+        path = 'broadcast/getbroadcastembedded'
+        param = {'broadcast': str(station_id)}
+        station = self.__api_call(path, param,
+                                  RadioApi.CACHE_TTLS['station'])
+        if self.__check_redirect(station['streamURL']):
+            with self.metrics.span('follow_redirect'):
+                station['streamURL'] = self.__follow_redirect(
+                    station['streamURL']
+                )
+        if resolve_playlists and self.__check_paylist(station['streamURL']):
+            with self.metrics.span('resolve_playlist'):
+                station['streamURL'] = self.__resolve_playlist(station)
+        return station
+
+    def __api_call(self, path, param=None, ttl=0):
         self.log('__api_call started with path=%s, param=%s'
                  % (path, param))
         url = '%s/%s' % (self.api_url, path)
         if param:
             url += '?%s' % urlencode(param)
-        response = self.__urlopen(url)
-        json_data = json.loads(response)
+        key = json.dumps([self.api_url, path, sorted((param or {}).items())])
+        cache_key = None
+        if self.cache is not None and ttl:
+            cache_key = key
+            json_data = self.cache.get(cache_key,
+                                       min_ttl=self.refresh_ahead)
+            if json_data is not None:
+                self.log('__api_call cache hit')
+                self.metrics.record('cache_hit', 0, path)
+                return json_data
+        if self.single_flight is None:
+            return self.__fetch_json(url, path, cache_key, ttl)
+        lookup = None
+        if cache_key is not None:
+            # the result is written to the cache anyway
+            lookup = lambda: self.cache.get(cache_key,
+                                            min_ttl=self.refresh_ahead)
+        return self.single_flight.do(
+            key, lambda: self.__fetch_json(url, path, cache_key, ttl), path,
+            self.__max_call_time(), lookup
+        )
+
+    def __fetch_json(self, url, path, cache_key, ttl):
+        try:
+            response = self.__urlopen(url, path)
+        except RadioApiError:
+            if cache_key is not None:
+                json_data = self.cache.get(cache_key, allow_stale=True)
+                if json_data is not None:
+                    self.log('__api_call serving stale cache entry')
+                    return json_data
+            raise
+        from projection import loads
+        with self.metrics.span('json_loads', path):
+            json_data = loads(response, 'pictureBaseURL',
+                              RadioApi.STATION_FIELDS)
+        if cache_key is not None:
+            self.cache.set(cache_key, json_data, ttl)
         return json_data
 
     def __resolve_playlist(self, station):
@@ -149,85 +348,126 @@ class RadioApi():
                  % station['id'])
         servers = []
         stream_url = station['streamURL']
-        if stream_url.lower().endswith('m3u'):
-            response = self.__urlopen(stream_url)
-            self.log('__resolve_playlist found .m3u file')
-            servers = [
-                l for l in response.splitlines()
-                if l.strip() and not l.strip().startswith('#')
-            ]
-        elif stream_url.lower().endswith('pls'):
-            response = self.__urlopen(stream_url)
-            self.log('__resolve_playlist found .pls file')
-            servers = [
-                l.split('=')[1] for l in response.splitlines()
-                if l.lower().startswith('file')
-            ]
-        elif stream_url.lower().endswith('asx'):
-            response = self.__urlopen(stream_url)
-            self.log('__resolve_playlist found .asx file')
-            servers = [
-                l.split('href="')[1].split('"')[0]
-                for l in response.splitlines() if 'href' in l
-            ]
-        elif stream_url.lower().endswith('xml'):
+        if stream_url.lower().endswith('xml'):
             self.log('__resolve_playlist found .xml file')
             servers = [
                 stream_url['streamUrl']
                 for stream_url in station.get('streamUrls', [])
                 if 'streamUrl' in stream_url
             ]
+        else:
+            from playlist import PlaylistResolver
+            try:
+                with self.metrics.span('urlopen',
+                                       urlsplit(stream_url).netloc):
+                    servers = PlaylistResolver(
+                        self.__get_transport()
+                    ).resolve(stream_url)
+            except TransportError, error:
+                self.log('__resolve_playlist error: %s' % error)
+                raise StationError('URLError: %s' % error)
         if servers:
             self.log('__resolve_playlist found %d servers' % len(servers))
+            if self.probe_servers and len(servers) > 1:
+                server = self.prober.select(servers)
+                if server:
+                    self.log('__resolve_playlist probed server=%s' % server)
+                    return server
+                return self.prober.rank(servers)[0]
             return random.choice(servers)
         return stream_url
 
     def __follow_redirect(self, url):
         self.log('__follow_redirect probing url=%s' % url)
-        req = Request(url)
-        req.add_header('User-Agent', self.user_agent)
-        response = urlopen(req)
+        try:
+            response = self.__request_headers(url)
+        except TransportError, error:
+            self.log('__follow_redirect error: %s' % error)
+            raise StationError('URLError: %s' % error)
         return response.geturl()
 
-    def __urlopen(self, url):
-        self.log('__urlopen opening url=%s' % url)
-        req = Request(url)
-        req.add_header('User-Agent', self.user_agent)
+    def __request_headers(self, url, timeout=None):
+        transport = self.__get_transport()
         try:
-            response = urlopen(req).read()
-        except HTTPError, error:
-            self.log('__urlopen HTTPError: %s' % error)
-            raise RadioApiError('HTTPError: %s' % error)
-        except URLError, error:
-            self.log('__urlopen URLError: %s' % error)
-            raise RadioApiError('URLError: %s' % error)
-        return response
+            return transport.request(url, method='HEAD', read_body=False,
+                                     timeout=timeout)
+        except HTTPStatusError:
+            # some stream servers only answer GET, its body is not read
+            return transport.request(url, read_body=False, timeout=timeout)
+
+    def __urlopen(self, url, endpoint=None):
+        self.log('__urlopen opening url=%s' % url)
+        endpoint = endpoint or urlsplit(url).netloc
+        # the same path of another language is another host
+        breaker_key = '%s %s' % (urlsplit(url).netloc, endpoint)
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.acquire(
+                    breaker_key, endpoint not in RadioApi.UNLIMITED_PATHS
+                )
+            try:
+                with self.metrics.span('urlopen', endpoint):
+                    response = self.__get_transport().request(url).read()
+            except TransportError, error:
+                failed = self.__is_failure(error)
+                if self.breaker is not None:
+                    self.breaker.record(breaker_key, failed)
+                if (not failed or isinstance(error, TransportTimeoutError)
+                        or attempt >= RadioApi.RETRIES):
+                    if isinstance(error, HTTPStatusError):
+                        self.log('__urlopen HTTPError: %s' % error)
+                        raise RadioApiError('HTTPError: %s' % error)
+                    self.log('__urlopen URLError: %s' % error)
+                    raise RadioApiError('URLError: %s' % error)
+                attempt += 1
+                delay = random.uniform(
+                    0, RadioApi.RETRY_BACKOFF * 2 ** attempt
+                )
+                self.log('__urlopen retry %d in %.2f s after: %s'
+                         % (attempt, delay, error))
+                time.sleep(delay)
+                continue
+            if self.breaker is not None:
+                self.breaker.record(breaker_key, False)
+            return response
+
+    def __max_call_time(self, stream_requests=0):
+        # an api request with all retries and their delays, followed by
+        # stream_requests requests to stream or playlist hosts
+        backoff = sum(RadioApi.RETRY_BACKOFF * 2 ** attempt
+                      for attempt in xrange(1, RadioApi.RETRIES + 1))
+        return (self.timeout * (RadioApi.RETRIES + 1 + stream_requests) +
+                backoff)
 
     @staticmethod
-    def __format_stations(stations):
-        formated_stations = []
-        for station in stations:
-            thumbnail = (
-                station.get('picture4TransName') or
-                station.get('picture4Name') or
-                station.get('picture1TransName').replace('_1_', '_4_') or
-                station.get('picture1Name').replace('_1_', '_4_')
-            )
-            genre = station.get('genresAndTopics') or ','.join(
-                station.get('genres', []) + station.get('topics', []),
-            )
-            formated_stations.append({
-                'name': station['name'],
-                'thumbnail': station['pictureBaseURL'] + thumbnail,
-                'rating': station['rating'],
-                'genre': genre,
-                'bitrate': station['bitrate'],
-                'id': station['id'],
-                'current_track': station['currentTrack'],
-                'stream_url': station.get('streamURL', ''),
-                'description': station.get('description', '')
-            })
-        return formated_stations
+    def __is_failure(error):
+        # client errors are answers of a healthy api
+        if isinstance(error, HTTPStatusError):
+            return error.status >= 500 or error.status == 429
+        return True
+
+    def __get_transport(self):
+        if self.transport is None:
+            from transport import HttpTransport
+            self.transport = HttpTransport(self.user_agent, self.timeout)
+            self.prober.transport = self.transport
+        return self.transport
+
+    def __format_stations(self, stations):
+        if not self.metrics.enabled:
+            for station in stations:
+                yield Station.from_api(station)
+            return
+        duration = 0.0
+        try:
+            for station in stations:
+                start = time.time()
+                station = Station.from_api(station)
+                duration += time.time() - start
+                yield station
+        finally:
+            self.metrics.record('format_stations', duration)
 
     @staticmethod
     def __check_paylist(stream_url):
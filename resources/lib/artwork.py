@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from StringIO import StringIO
+
+from errors import TransportError
+
+try:
+    from PIL import Image
+except ImportError:
+    # logos are stored as downloaded
+    Image = None
+
+
+class ArtworkCache():
+    # Station logos on disk, looked up by their url. Many stations share a
+    # logo url, every url is stored once. The least recently listed logos
+    # are evicted beyond max_size.
+
+    MAX_SIZE = 32 * 1024 * 1024
+    MAX_LOGO_SIZE = 1024 * 1024
+    # logos are downscaled to this many pixels (if PIL is available)
+    LOGO_SIZE = 256
+    EXTENSIONS = {
+        'image/png': '.png',
+        'image/jpeg': '.jpg',
+        'image/jpg': '.jpg',
+        'image/gif': '.gif',
+    }
+    # sqlite limits the number of parameters of a query
+    _CHUNK_SIZE = 500
+
+    def __init__(self, path, transport=None, max_size=MAX_SIZE):
+        self.path = path
+        self.transport = transport
+        self.max_size = max_size
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def get_paths(self, urls):
+        # local paths of the cached logos out of urls
+        urls = list(set(url for url in urls if url))
+        paths = {}
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            for i in xrange(0, len(urls), self._CHUNK_SIZE):
+                chunk = urls[i:i + self._CHUNK_SIZE]
+                rows = conn.execute(
+                    'SELECT url, filename FROM artwork WHERE url IN (%s)'
+                    % ','.join('?' * len(chunk)), chunk
+                ).fetchall()
+                for url, filename in rows:
+                    paths[url] = os.path.join(self.path, filename)
+                conn.executemany(
+                    'UPDATE artwork SET accessed = ? WHERE url = ?',
+                    [(now, url) for url, filename in rows]
+                )
+            conn.commit()
+        return paths
+
+    def fetch(self, urls, should_stop=None):
+        # downloads the logos which are not cached yet
+        cached = self.get_paths(urls)
+        num_fetched = 0
+        for url in set(urls) - set(cached):
+            if not url or (should_stop and should_stop()):
+                continue
+            try:
+                data, extension = self._download(url)
+            except (TransportError, IOError), error:
+                self.log('fetching %s failed: %s' % (url, error))
+                continue
+            if data is None:
+                continue
+            self._store(url, data, extension)
+            num_fetched += 1
+        return num_fetched
+
+    def _download(self, url):
+        response = self.transport.request(url, max_size=self.MAX_LOGO_SIZE)
+        content_type = response.headers.get('content-type', '')
+        extension = self.EXTENSIONS.get(content_type.split(';')[0].strip())
+        data = response.read()
+        if extension is None or len(data) >= self.MAX_LOGO_SIZE:
+            return None, None
+        if Image is not None:
+            image = Image.open(StringIO(data))
+            if max(image.size) > self.LOGO_SIZE:
+                image.thumbnail((self.LOGO_SIZE, self.LOGO_SIZE),
+                                Image.ANTIALIAS)
+                output = StringIO()
+                image.save(output, 'PNG')
+                data, extension = output.getvalue(), '.png'
+        return data, extension
+
+    def _store(self, url, data, extension):
+        filename = hashlib.sha1(url.encode('utf-8')).hexdigest() + extension
+        tmp_file = os.path.join(self.path, filename + '.tmp')
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        # os.rename does not overwrite on windows
+        if os.path.isfile(os.path.join(self.path, filename)):
+            os.remove(os.path.join(self.path, filename))
+        os.rename(tmp_file, os.path.join(self.path, filename))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                ('INSERT OR REPLACE INTO artwork (url, filename, size, '
+                 'accessed) VALUES (?, ?, ?, ?)'),
+                (url, filename, len(data), time.time())
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        total_size = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM artwork'
+        ).fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        rows = conn.execute(
+            'SELECT url, filename, size FROM artwork ORDER BY accessed'
+        ).fetchall()
+        for url, filename, size in rows:
+            if total_size <= self.max_size:
+                break
+            conn.execute('DELETE FROM artwork WHERE url = ?', (url, ))
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+            total_size -= size
+
+    def _connect(self):
+        if self._conn is None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            self._conn = sqlite3.connect(
+                os.path.join(self.path, 'artwork.db'), timeout=10,
+                check_same_thread=False
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS artwork (url TEXT PRIMARY KEY, '
+                'filename TEXT, size INTEGER, accessed REAL)'
+            )
+        return self._conn
+
+    @staticmethod
+    def log(text):
+        print 'ArtworkCache: %s' % repr(text)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import time
+from Queue import Queue
+
+from api import RadioApi
+from errors import RadioApiError
+
+
+class Future():
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RadioApiError('No result after %s s' % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class AsyncRadioApi():
+    # RadioApi calls run on a pool of worker threads and return Futures.
+    # python 2 has no asyncio, so concurrency comes from threads and the
+    # transport limits the concurrent requests per host. Formatting,
+    # caching and playlist resolving are the ones of the wrapped RadioApi.
+
+    WORKERS = 8
+    MAX_PER_HOST = 4
+
+    def __init__(self, radio_api=None, workers=WORKERS,
+                 max_per_host=MAX_PER_HOST):
+        from transport import HttpTransport
+        if radio_api is None:
+            radio_api = RadioApi()
+        if radio_api.transport is None:
+            radio_api.transport = HttpTransport(radio_api.user_agent,
+                                                radio_api.timeout)
+            radio_api.prober.transport = radio_api.transport
+        radio_api.transport.max_active_per_host = max_per_host
+        self.radio_api = radio_api
+        self.workers = workers
+        self._queue = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def get_top_stations(self):
+        return self.submit(self.radio_api.get_top_stations)
+
+    def get_recommendation_stations(self):
+        return self.submit(self.radio_api.get_recommendation_stations)
+
+    def get_local_stations(self, num_entries=25):
+        return self.submit(self.radio_api.get_local_stations, num_entries)
+
+    def get_categories(self, category_type):
+        return self.submit(self.radio_api.get_categories, category_type)
+
+    def get_stations_by_category(self, category_type, category_value):
+        return self.submit(self.radio_api.get_stations_by_category,
+                           category_type, category_value)
+
+    def search_stations_by_string(self, search_string):
+        return self.submit(self.radio_api.search_stations_by_string,
+                           search_string)
+
+    def get_station_by_station_id(self, station_id, resolve_playlists=True):
+        return self.submit(self.radio_api.get_station_by_station_id,
+                           station_id, resolve_playlists)
+
+    def submit(self, func, *args):
+        future = Future()
+        self._queue.put((func, args, future))
+        with self._lock:
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    @staticmethod
+    def gather(futures, timeout=None):
+        # results in the order of futures, failed ones as their exception
+        deadline = time.time() + timeout if timeout is not None else None
+        results = []
+        for future in futures:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            try:
+                results.append(future.result(remaining))
+            except Exception, error:
+                results.append(error)
+        return results
+
+    def _work(self):
+        # workers live as long as the process, they are daemon threads
+        while True:
+            func, args, future = self._queue.get()
+            try:
+                future.set_result(func(*args))
+            except Exception, error:
+                future.set_error(error)
@@ -0,0 +1,870 @@
+# Offline benchmarks against recorded responses served by standin.py.
+#
+#   python bench.py                    run the suite, compare with baseline
+#   python bench.py --save-baseline    run the suite, store it as baseline
+#   python bench.py 'resolve_*'        run matching suite cases only
+#   python bench.py transport          run one of the COMPARISONS
+#
+import argparse
+import fnmatch
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib2 import urlopen, Request
+from xml.dom import minidom
+
+import playlist
+from api import RadioApi
+from asyncapi import AsyncRadioApi
+from standin import FIXTURES, StandinServer, fixture_routes
+from station import Station
+from transport import HttpTransport, Response
+
+RESOLVES = 50
+HANDSHAKE_DELAY = 0.005
+PLAYS = 20
+PROBE_HANG = 5
+PLAYLIST_PARSES = 2000
+API_DELAY = 0.05
+FUZZ_CASES = 5000
+STREAM_TIMEOUT = 2
+NUM_STATIONS = 10000
+ITERATIONS = 50
+# a suite case is reported as regression when its median gets this slower
+REGRESSION_FACTOR = 1.5
+REGRESSION_MIN_DELTA = 0.001
+
+ADDON_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+)
+BASELINE_FILE = os.path.join(FIXTURES, 'bench_baseline.json')
+PLAYLIST_CORPUS = os.path.join(FIXTURES, 'playlist_corpus')
+
+
+def do_nothing(*args, **kwargs):
+    pass
+
+
+class Urllib2Transport():
+    # the transport RadioApi used before HttpTransport, kept for comparison
+
+    def __init__(self, user_agent):
+        self.user_agent = user_agent
+
+    def request(self, url, method='GET', headers=None, read_body=True,
+                timeout=None, max_size=None):
+        req = Request(url)
+        req.add_header('User-Agent', self.user_agent)
+        response = urlopen(req)
+        if callable(read_body):
+            read_body = read_body(dict(response.info()))
+        body = response.read(max_size or -1) if read_body else ''
+        return Response(response.geturl(), response.code, {}, body)
+
+
+def load_broadcasts(count):
+    # expands the recorded broadcasts to a search result of count stations
+    samples = json.load(open(os.path.join(FIXTURES, 'broadcasts.json')))
+    broadcasts = []
+    for i in xrange(count):
+        broadcast = dict(samples[i % len(samples)])
+        broadcast['id'] = 100000 + i
+        broadcast['name'] = u'%s %d' % (broadcast['name'], i)
+        broadcasts.append(broadcast)
+    # decode again so every station has its own strings like in real life
+    return json.loads(json.dumps(broadcasts))
+
+
+def deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += deep_size(value, seen)
+    elif hasattr(obj, '__slots__'):
+        for slot in obj.__slots__:
+            size += deep_size(getattr(obj, slot, None), seen)
+    return size
+
+
+def format_stations_dict(stations):
+    # RadioApi.__format_stations before the Station record type
+    formated_stations = []
+    for station in stations:
+        thumbnail = (
+            station.get('picture4TransName') or
+            station.get('picture4Name') or
+            station.get('picture1TransName').replace('_1_', '_4_') or
+            station.get('picture1Name').replace('_1_', '_4_')
+        )
+        genre = station.get('genresAndTopics') or ','.join(
+            station.get('genres', []) + station.get('topics', []),
+        )
+        formated_stations.append({
+            'name': station['name'],
+            'thumbnail': station['pictureBaseURL'] + thumbnail,
+            'rating': station['rating'],
+            'genre': genre,
+            'bitrate': station['bitrate'],
+            'id': station['id'],
+            'current_track': station['currentTrack'],
+            'stream_url': station.get('streamURL', ''),
+            'description': station.get('description', '')
+        })
+    return formated_stations
+
+
+def format_stations_record(stations):
+    return [Station.from_api(station) for station in stations]
+
+
+def render(stations):
+    # the station fields __add_stations reads for every list item
+    for station in stations:
+        (station.get('name', ''), station['thumbnail'],
+         str(station.get('rating', '0.0')), station.get('genre', ''),
+         int(station.get('bitrate', 0)), station.get('current_track', ''),
+         str(station['id']))
+
+
+def bench_station():
+    broadcasts = load_broadcasts(NUM_STATIONS)
+    shared = set()
+    deep_size(broadcasts, shared)
+    print 'Formatting and rendering %d stations' % NUM_STATIONS
+    for name, format_stations in (('dict', format_stations_dict),
+                                  ('Station', format_stations_record)):
+        start = time.time()
+        stations = format_stations(broadcasts)
+        format_duration = time.time() - start
+        start = time.time()
+        render(stations)
+        render_duration = time.time() - start
+        # only count memory which is not shared with the decoded response
+        size = deep_size(stations, set(shared))
+        print ('  %-8s format %6.1f ms  render %6.1f ms  retained %6.2f MB'
+               % (name, format_duration * 1000, render_duration * 1000,
+                  size / 1024.0 / 1024))
+
+
+def legacy_parse_playlist(stream_url, response):
+    # the suffix based parsing RadioApi used before playlist.py
+    if stream_url.lower().endswith('m3u'):
+        return [
+            l for l in response.splitlines()
+            if l.strip() and not l.strip().startswith('#')
+        ]
+    elif stream_url.lower().endswith('pls'):
+        return [
+            l.split('=')[1] for l in response.splitlines()
+            if l.lower().startswith('file')
+        ]
+    elif stream_url.lower().endswith('asx'):
+        return [
+            l.split('href="')[1].split('"')[0]
+            for l in response.splitlines() if 'href' in l
+        ]
+    return []
+
+
+def mutate(rand, body, bodies):
+    mutation = rand.randrange(5)
+    if mutation == 0 and body:
+        return body[:rand.randrange(len(body))]
+    elif mutation == 1 and body:
+        i = rand.randrange(len(body))
+        return body[:i] + chr(rand.randrange(256)) + body[i + 1:]
+    elif mutation == 2:
+        other = rand.choice(bodies)
+        return body[:rand.randrange(len(body) + 1)] + other
+    elif mutation == 3:
+        return body.upper() if rand.random() < 0.5 else body.lower()
+    return ''.join(rand.choice(('\r\n', '\n', ' ', '<', '=', '"', body))
+                   for i in xrange(rand.randrange(1, 20)))
+
+
+def bench_playlist():
+    corpus = json.load(open(os.path.join(PLAYLIST_CORPUS, 'expected.json')))
+    base_url = str(corpus['base_url'])
+    bodies = {}
+    mismatches = []
+    for filename, expected in sorted(corpus['expected'].items()):
+        filename = str(filename)
+        bodies[filename] = open(os.path.join(PLAYLIST_CORPUS,
+                                             filename)).read()
+        urls = playlist.parse(bodies[filename],
+                              url=base_url + filename)
+        if (urls or []) != expected:
+            mismatches.append(filename)
+    print 'Corpus of %d playlists, mismatches: %s' % (
+        len(bodies), ', '.join(mismatches) or 'none'
+    )
+    rand = random.Random(0)
+    failures = 0
+    for i in xrange(FUZZ_CASES):
+        filename = rand.choice(bodies.keys())
+        body = mutate(rand, bodies[filename], bodies.values())
+        try:
+            urls = playlist.parse(body, url=base_url + filename)
+            assert urls is None or all(isinstance(u, str) for u in urls)
+        except Exception, error:
+            failures += 1
+            if failures <= 3:
+                print '  fuzz failure %r: %r' % (error, body[:80])
+    print 'Fuzzed %d mutated playlists, failures: %d' % (FUZZ_CASES,
+                                                         failures)
+    print 'Parsing each fixture playlist %d times' % PLAYLIST_PARSES
+    playlist_dir = os.path.join(FIXTURES, 'playlists')
+    for filename in sorted(os.listdir(playlist_dir)):
+        body = open(os.path.join(playlist_dir, filename)).read().replace(
+            '{server}', 'http://host.example'
+        )
+        url = 'http://host.example/%s' % filename
+        timings = []
+        for name, parse in (('legacy', legacy_parse_playlist),
+                            ('playlist', lambda url, body: playlist.parse(
+                                body, url=url))):
+            start = time.time()
+            for i in xrange(PLAYLIST_PARSES):
+                parse(url, body)
+            timings.append('%s %6.2f us' % (
+                name, (time.time() - start) / PLAYLIST_PARSES * 1000000
+            ))
+        print '  %-10s %s' % (filename, '  '.join(timings))
+
+
+def station_routes(server):
+    station = {
+        'id': 2279,
+        'name': 'Stand-in FM',
+        'pictureBaseURL': server.url('/logos/'),
+        'picture4Name': '2279_4_.png',
+        'rating': 4.5,
+        'bitrate': 128,
+        'genresAndTopics': 'Pop,Rock',
+        'currentTrack': 'Artist - Title',
+        'streamURL': server.url('/addrad.io/2279'),
+    }
+    return {
+        '/info/broadcast/getbroadcastembedded': (
+            200, {'Content-Type': 'application/json'}, json.dumps(station)
+        ),
+        '/addrad.io/2279': (
+            302, {'Location': server.url('/2279.m3u')}, ''
+        ),
+        '/2279.m3u': (
+            200, {'Content-Type': 'audio/x-mpegurl'},
+            '#EXTM3U\n%s\n' % server.url('/stream/2279')
+        ),
+        '/stream/2279': (200, {'Content-Type': 'audio/mpeg'}, None),
+    }
+
+
+def bench_transport():
+    server = StandinServer(handshake_delay=HANDSHAKE_DELAY).start()
+    server.routes = station_routes(server)
+    transports = (
+        ('urllib2', Urllib2Transport(RadioApi.USER_AGENT)),
+        ('no keep-alive', HttpTransport(RadioApi.USER_AGENT,
+                                        max_idle_per_host=0)),
+        ('keep-alive', HttpTransport(RadioApi.USER_AGENT)),
+    )
+    print 'Resolving a station %d times per transport' % RESOLVES
+    for name, transport in transports:
+        ra = RadioApi(transport=transport)
+        ra.api_url = server.url('/info')
+        ra.log = do_nothing
+        server.reset_counters()
+        start = time.time()
+        for i in xrange(RESOLVES):
+            ra.get_station_by_station_id(2279)
+        duration = time.time() - start
+        print ('  %-14s %6.2f ms/resolve  %5.2f connections/resolve  '
+               '%5.2f requests/resolve' % (
+                   name, duration * 1000 / RESOLVES,
+                   float(server.connections) / RESOLVES,
+                   float(server.requests) / RESOLVES,
+               ))
+        if isinstance(transport, HttpTransport):
+            transport.close()
+    server.stop()
+
+
+def bench_probe():
+    server = StandinServer().start()
+    routes = station_routes(server)
+
+    def hang(handler):
+        time.sleep(PROBE_HANG)
+        return 200, {'Content-Type': 'audio/mpeg'}, None
+
+    def slow(handler):
+        time.sleep(0.2)
+        return 200, {'Content-Type': 'audio/mpeg'}, None
+
+    mirrors = {
+        '/mirror/dead': (404, {}, 'gone'),
+        '/mirror/html': (200, {'Content-Type': 'text/html'}, '<html/>'),
+        '/mirror/hang': hang,
+        '/mirror/slow': slow,
+        '/mirror/fast': (200, {'Content-Type': 'audio/mpeg'}, None),
+    }
+    routes.update(mirrors)
+    routes['/2279.m3u'] = (200, {'Content-Type': 'audio/x-mpegurl'}, '\n'.join(
+        server.url(path) for path in sorted(mirrors)
+    ))
+    server.routes = routes
+    print ('Time to first audio over %d plays, %d of %d mirrors are broken'
+           % (PLAYS, 3, len(mirrors)))
+    for probe_servers in (False, True):
+        ra = RadioApi(probe_servers=probe_servers)
+        ra.api_url = server.url('/info')
+        ra.log = do_nothing
+        timings = []
+        failures = 0
+        for i in xrange(PLAYS):
+            start = time.time()
+            # like Kodi, give up on a bad stream after STREAM_TIMEOUT
+            try:
+                stream_url = ra.get_station_by_station_id(2279)['stream_url']
+                response = ra.transport.request(stream_url, read_body=False,
+                                                timeout=STREAM_TIMEOUT)
+                if response.headers.get('content-type') != 'audio/mpeg':
+                    failures += 1
+            except Exception:
+                failures += 1
+            timings.append(time.time() - start)
+        timings.sort()
+        print ('  %-8s median %7.1f ms  worst %7.1f ms  failed plays %d' % (
+            'probe' if probe_servers else 'random',
+            timings[len(timings) // 2] * 1000, timings[-1] * 1000, failures
+        ))
+    server.stop()
+
+
+def check_migration():
+    # my_stations.json as written by the TimedStorage of plugin.get_storage
+    from xbmcswift2 import TimedStorage
+    from favourites import MyStations
+    tmp_dir = tempfile.mkdtemp()
+    legacy_path = os.path.join(tmp_dir, 'my_stations.json')
+    storage = TimedStorage(legacy_path, file_format='json')
+    stations = {
+        '2279': {'id': 2279, 'name': 'Stand-in FM',
+                 'thumbnail': 'http://host/logos/2279.png',
+                 'rating': 4.5, 'genre': 'Pop', 'bitrate': 128,
+                 'current_track': 'Artist - Title', 'stream_url': ''},
+        'My Custom': {'id': 'My Custom', 'name': 'My Custom',
+                      'thumbnail': '', 'stream_url': 'http://host/stream',
+                      'is_custom': '1'},
+    }
+    for station_id, station in stations.items():
+        storage[station_id] = station
+    storage.sync()
+    my_stations = MyStations(os.path.join(tmp_dir, 'my_stations.db'),
+                             legacy_path)
+    assert dict(my_stations.items()) == stations, 'migrated stations differ'
+    assert my_stations.get('My Custom').get('is_custom') == '1'
+    assert os.path.isfile(legacy_path + '.migrated')
+    shutil.rmtree(tmp_dir)
+    print '  %d stations migrated from a TimedStorage file' % len(stations)
+
+
+STARTUP_ROUTES = (
+    '/',
+    '/stations/search/',
+    '/stations/my/',
+    '/stations/top/',
+    '/stations/genre/',
+    '/stations/genre/Pop/',
+    '/station/2279',
+)
+STARTUP_RUNS = 10
+
+
+def bench_startup():
+    server = StandinServer().start()
+    server.routes = fixture_routes(server)
+    print ('Cold start of the plugin per route, median of %d fresh '
+           'interpreters (the first run fills the cache)' % STARTUP_RUNS)
+    for path in STARTUP_ROUTES:
+        try:
+            results = [run_plugin(server, path)
+                       for i in xrange(STARTUP_RUNS)]
+        except RuntimeError, error:
+            print '  %-24s skipped: %s' % (path, error)
+            continue
+        results.sort(key=lambda result: result['total'])
+        median = results[len(results) // 2]
+        print ('  %-24s total %6.1f ms  import %6.1f ms  route %6.1f ms  '
+               'loaded: %s' % (
+                   path, median['total'] * 1000, median['import'] * 1000,
+                   median['run'] * 1000, ', '.join(median['modules']) or '-'
+               ))
+    server.stop()
+
+
+def bench_async():
+    server = StandinServer(response_delay=API_DELAY).start()
+    server.routes = fixture_routes(server)
+    calls = [
+        ('get_categories', (category_type, ))
+        for category_type in RadioApi.CATEGORY_TYPES
+    ] + [
+        ('get_stations_by_category', ('genre', genre))
+        for genre in ('Pop', 'Rock', 'Jazz', 'Classical', 'Dance')
+    ] + [
+        ('get_station_by_station_id', (station_id, ))
+        for station_id in (2279, 3643, 9081)
+    ]
+    print ('%d api calls (categories, station lists and playlists) with '
+           '%d ms server delay' % (len(calls), API_DELAY * 1000))
+    ra = get_api(server)
+    start = time.time()
+    for name, args in calls:
+        getattr(ra, name)(*args)
+    print '  RadioApi        %7.1f ms' % ((time.time() - start) * 1000)
+    for max_per_host in (2, 4):
+        async_api = AsyncRadioApi(get_api(server), max_per_host=max_per_host)
+        start = time.time()
+        futures = [getattr(async_api, name)(*args) for name, args in calls]
+        errors = [r for r in AsyncRadioApi.gather(futures)
+                  if isinstance(r, Exception)]
+        print '  AsyncRadioApi   %7.1f ms  %d per host, %d errors' % (
+            (time.time() - start) * 1000, max_per_host, len(errors)
+        )
+    server.stop()
+
+
+DECODE_RUNS = 5
+# run by a fresh interpreter per decoder, so the peak memory is its own
+DECODE_SCRIPT = '''
+import json, resource, sys, time
+if %(hide_simplejson)r:
+    sys.modules['simplejson'] = None
+from api import RadioApi
+from projection import loads
+def get_peak_rss():
+    # ru_maxrss is inherited from the (large) bench process on linux
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start_rss = get_peak_rss()
+text = open(%(payload)r).read()
+timings = []
+for i in xrange(%(runs)d):
+    start = time.time()
+    if %(project)r:
+        data = loads(text, 'pictureBaseURL', RadioApi.STATION_FIELDS)
+    else:
+        data = json.loads(text)
+    timings.append(time.time() - start)
+    if i < %(runs)d - 1:
+        del data
+peak_rss = get_peak_rss()
+cached = json.dumps(data)
+start = time.time()
+json.loads(cached)
+print json.dumps({
+    'decode': sorted(timings)[len(timings) // 2],
+    'peak_growth_kb': peak_rss - start_rss,
+    'cached_size': len(cached),
+    'cache_hit': time.time() - start,
+})
+'''
+DECODERS = (
+    # name, project, hide_simplejson
+    ('json', False, True),
+    ('json projected', True, True),
+    ('simplejson projected', True, False),
+)
+
+
+def bench_decode():
+    payload = os.path.join(FIXTURES, '..', 'decode_payload.json.tmp')
+    json.dump(load_broadcasts(NUM_STATIONS), open(payload, 'w'))
+    print ('Decoding a search result of %d stations (%.1f MB), median of '
+           '%d runs, the peak includes the response text' % (
+               NUM_STATIONS, os.path.getsize(payload) / 1024.0 / 1024,
+               DECODE_RUNS,
+           ))
+    for name, project, hide_simplejson in DECODERS:
+        script = DECODE_SCRIPT % {
+            'hide_simplejson': hide_simplejson, 'payload': payload,
+            'runs': DECODE_RUNS, 'project': project,
+        }
+        child = subprocess.Popen(
+            [sys.executable, '-c', script],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdin=open(os.devnull), stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = child.communicate()
+        if child.returncode:
+            print '  %-22s skipped: %s' % (
+                name, (stderr.strip().splitlines() or ['failed'])[-1]
+            )
+            continue
+        result = json.loads(stdout.strip().splitlines()[-1])
+        print ('  %-22s decode %6.1f ms  peak +%6.1f MB  cached %6.2f MB  '
+               'cache hit %6.1f ms' % (
+                   name, result['decode'] * 1000,
+                   result['peak_growth_kb'] / 1024.0,
+                   result['cached_size'] / 1024.0 / 1024,
+                   result['cache_hit'] * 1000,
+               ))
+    os.remove(payload)
+
+
+RENDER_SIZES = (1000, 10000)
+RENDER_FAVOURITES = 50
+
+
+def legacy_render_items(stations, my_station_ids, url_for, get_string):
+    # the item loop of addon.__add_stations before ItemRenderer
+    items = []
+    for i, station in enumerate(stations):
+        station_id = str(station['id'])
+        if not station_id in my_station_ids:
+            context_menu = [(
+                get_string('add_to_my_stations'),
+                'XBMC.RunPlugin(%s)' % url_for('add_to_my_stations',
+                                               station_id=station_id),
+            )]
+        else:
+            context_menu = [(
+                get_string('remove_from_my_stations'),
+                'XBMC.RunPlugin(%s)' % url_for('del_from_my_stations',
+                                               station_id=station_id),
+            )]
+        if station.get('is_custom', False):
+            context_menu.append((
+                get_string('edit_custom_station'),
+                'XBMC.RunPlugin(%s)' % url_for('custom_my_station',
+                                               station_id=station_id),
+            ))
+        items.append({
+            'label': station.get('name', ''),
+            'thumbnail': station['thumbnail'],
+            'info': {
+                'title': station.get('name', ''),
+                'rating': str(station.get('rating', '0.0')),
+                'genre': station.get('genre', ''),
+                'size': int(station.get('bitrate', 0)),
+                'comment': station.get('current_track', ''),
+                'count': i,
+            },
+            'context_menu': context_menu,
+            'path': url_for('get_stream_url', station_id=station_id),
+            'is_playable': True,
+        })
+    return items
+
+
+def bench_render():
+    os.environ.update(cli_environment())
+    os.chdir(ADDON_DIR)
+    sys.path.insert(0, ADDON_DIR)
+    sys.argv = ['plugin://plugin.audio.radio_de/', '0', '']
+    import addon
+    from render import ItemRenderer
+    url_for, get_string = addon.plugin.url_for, getattr(addon, '_')
+    print ('List items of search results, %d of the stations are '
+           'favourites, best of 5 runs' % RENDER_FAVOURITES)
+    for num_stations in RENDER_SIZES:
+        stations = format_stations_record(load_broadcasts(num_stations))
+        stations.append({'id': 'My Custom', 'name': 'My Custom',
+                         'thumbnail': '', 'is_custom': '1'})
+        favourites = [str(station['id']) for station in
+                      stations[::len(stations) // RENDER_FAVOURITES]]
+        renderer = ItemRenderer(url_for, get_string)
+        cases = (
+            ('legacy', lambda: legacy_render_items(stations, favourites,
+                                                   url_for, get_string)),
+            ('ItemRenderer', lambda: renderer.render(stations,
+                                                     set(favourites))),
+        )
+        results = []
+        for name, func in cases:
+            timings = []
+            for i in xrange(5):
+                start = time.time()
+                items = func()
+                timings.append(time.time() - start)
+            results.append(items)
+            print '  %5d stations  %-12s %7.1f ms' % (
+                num_stations, name, min(timings) * 1000
+            )
+        assert results[0] == results[1], 'rendered items differ'
+
+
+COMPARISONS = {
+    'async': bench_async,
+    'decode': bench_decode,
+    'migration': check_migration,
+    'playlist': bench_playlist,
+    'probe': bench_probe,
+    'render': bench_render,
+    'startup': bench_startup,
+    'station': bench_station,
+    'transport': bench_transport,
+}
+
+
+# run by a fresh interpreter like Kodi does for every plugin call, only
+# pointing the lazily built api client at the stand-in server
+PLUGIN_SCRIPT = '''
+import sys, time, json
+# python -c passes '-c' as argv[0], kodi passes the plugin url
+sys.argv = sys.argv[1:]
+start = time.time()
+import addon
+imported = time.time()
+get_radio_api = addon.radio_api
+def radio_api():
+    api = get_radio_api()
+    api.api_url = %(api_url)r
+    return api
+addon.radio_api = radio_api
+addon.plugin.run()
+done = time.time()
+# like the end of addon.py, stream urls are prefetched after the listing
+if addon.prefetcher.is_loaded():
+    addon.prefetcher().wait(addon.PREFETCH_TIMEOUT)
+# on a line of its own, the cli keyboard prompt ends without a newline
+print
+print json.dumps({
+    'import': imported - start,
+    'run': done - imported,
+    'modules': [m for m in ('httplib', 'sqlite3', 'resources.lib.api')
+                if m in sys.modules],
+})
+'''
+
+
+def cli_environment():
+    # xbmcswift2 asks for unknown settings on stdin in CLI mode
+    env = dict(os.environ)
+    settings = minidom.parse(os.path.join(ADDON_DIR, 'resources',
+                                          'settings.xml'))
+    for setting in settings.getElementsByTagName('setting'):
+        env_name = 'XBMCSWIFT2_%s' % setting.getAttribute('id').upper()
+        env[env_name] = setting.getAttribute('default')
+    env['XBMCSWIFT2_NOT_FIRST_RUN'] = '1'
+    return env
+
+
+def run_plugin(server, path):
+    # one plugin call in a fresh interpreter, returns its timings or
+    # raises RuntimeError with the last line of its error output
+    start = time.time()
+    child = subprocess.Popen(
+        [sys.executable, '-c',
+         PLUGIN_SCRIPT % {'api_url': server.url('/info')},
+         'plugin://plugin.audio.radio_de%s' % path, '0', ''],
+        cwd=ADDON_DIR, env=cli_environment(),
+        stdin=open(os.devnull), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = child.communicate()
+    total = time.time() - start
+    if child.returncode:
+        raise RuntimeError((stderr.strip().splitlines() or ['failed'])[-1])
+    result = json.loads(stdout.strip().splitlines()[-1])
+    result['total'] = total
+    return result
+
+
+def get_api(server):
+    ra = RadioApi()
+    ra.api_url = server.url('/info')
+    ra.log = do_nothing
+    return ra
+
+
+def api_call_case(path, param=None):
+    def setup(server):
+        api_call = get_api(server)._RadioApi__api_call
+        return lambda: api_call(path, param)
+    return setup
+
+
+def format_stations_case(server):
+    broadcasts = load_broadcasts(NUM_STATIONS)
+    format_stations = get_api(server)._RadioApi__format_stations
+    return lambda: list(format_stations(broadcasts))
+
+
+def resolve_playlist_case(station_id):
+    def setup(server):
+        ra = get_api(server)
+        station = ra._RadioApi__api_call('broadcast/getbroadcastembedded',
+                                         {'broadcast': station_id})
+        return lambda: ra._RadioApi__resolve_playlist(station)
+    return setup
+
+
+def station_case(station_id):
+    def setup(server):
+        ra = get_api(server)
+        return lambda: ra.get_station_by_station_id(station_id)
+    return setup
+
+
+def route_case(path):
+    # kodi runs every plugin call in a new interpreter, xbmcswift2 does not
+    # handle a second request in the same one either
+    def setup(server):
+        return lambda: run_plugin(server, path)
+    return setup
+
+
+SUITE = (
+    ('api_call.categories',
+     api_call_case('menu/valuesofcategory', {'category': '_genre'})),
+    ('api_call.stations',
+     api_call_case('menu/broadcastsofcategory',
+                   {'category': '_genre', 'value': 'Pop'})),
+    ('api_call.search',
+     api_call_case('index/searchembeddedbroadcast', {'q': 'wdr'})),
+    ('format_stations.%d' % NUM_STATIONS, format_stations_case),
+    ('resolve_playlist.m3u', resolve_playlist_case(2279)),
+    ('resolve_playlist.asx', resolve_playlist_case(3643)),
+    ('resolve_playlist.pls', resolve_playlist_case(9081)),
+    ('get_station_by_station_id', station_case(2279)),
+    ('route.root', route_case('/')),
+    ('route.top_stations', route_case('/stations/top/')),
+    ('route.categories', route_case('/stations/genre/')),
+    ('route.stations_by_category', route_case('/stations/genre/Pop/')),
+    ('route.search_result', route_case('/stations/search/wdr/')),
+    ('route.stream_url', route_case('/station/2279')),
+)
+
+
+def run_case(name, iterations):
+    # runs in its own process, so the peak memory belongs to this case
+    server = StandinServer().start()
+    server.routes = fixture_routes(server)
+    func = dict(SUITE)[name](server)
+    setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for i in xrange(iterations):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    # the route cases run in children
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    server.stop()
+    return {
+        'timings': timings,
+        'peak_rss_kb': peak_rss,
+        'peak_growth_kb': peak_rss - setup_rss,
+    }
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+
+def run_suite(patterns, iterations, save_baseline):
+    try:
+        baseline = json.load(open(BASELINE_FILE))
+    except IOError:
+        baseline = {}
+    results = {}
+    regressions = []
+    print ('%-28s %9s %9s %9s %9s %10s %9s' % (
+        'case', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'peak MB',
+        'vs base'
+    ))
+    for name, setup in SUITE:
+        if not any(fnmatch.fnmatch(name, p) for p in patterns):
+            continue
+        child = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--child', name,
+             '--iterations', str(iterations)],
+            stdin=open(os.devnull), stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = child.communicate()
+        if child.returncode:
+            print '%-28s skipped: %s' % (
+                name, (stderr.strip().splitlines() or ['failed'])[-1]
+            )
+            continue
+        result = json.loads(stdout.strip().splitlines()[-1])
+        timings = result['timings']
+        p50 = percentile(timings, 0.5)
+        results[name] = {
+            'p50': p50,
+            'p90': percentile(timings, 0.9),
+            'p99': percentile(timings, 0.99),
+            'max': max(timings),
+            'peak_rss_kb': result['peak_rss_kb'],
+        }
+        comparison = ''
+        if name in baseline:
+            base_p50 = baseline[name]['p50']
+            comparison = '%+8.0f%%' % ((p50 / base_p50 - 1) * 100)
+            if (p50 > base_p50 * REGRESSION_FACTOR and
+                    p50 - base_p50 > REGRESSION_MIN_DELTA):
+                regressions.append(name)
+                comparison += ' !'
+        print '%-28s %9.2f %9.2f %9.2f %9.2f %10.1f %9s' % (
+            name, p50 * 1000, results[name]['p90'] * 1000,
+            results[name]['p99'] * 1000, results[name]['max'] * 1000,
+            result['peak_rss_kb'] / 1024.0, comparison
+        )
+    if save_baseline:
+        baseline.update(results)
+        json.dump(baseline, open(BASELINE_FILE, 'w'), indent=1,
+                  sort_keys=True, separators=(',', ': '))
+        print 'Baseline saved to %s' % BASELINE_FILE
+    if regressions:
+        print 'Regressions: %s' % ', '.join(regressions)
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='suite case pattern or comparison name')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print json.dumps(run_case(args.child, args.iterations))
+        return 0
+    patterns = []
+    for name in args.names:
+        if name in COMPARISONS:
+            print 'Benchmark: %s' % name
+            COMPARISONS[name]()
+        else:
+            patterns.append(name)
+    if patterns or not args.names:
+        return 0 if run_suite(patterns or ['*'], args.iterations,
+                              args.save_baseline) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import time
+
+from errors import CircuitOpenError, RateLimitError
+
+
+class CircuitBreaker():
+    # Per endpoint circuit breaker and token bucket. The state is kept in
+    # store, so the next plugin process fails fast as well instead of
+    # running into the timeout again. Processes running at the same time
+    # may overwrite each others updates, which only shifts the limits by
+    # a request or two.
+    #
+    # After FAILURE_THRESHOLD failures in a row the endpoint is open for
+    # OPEN_TIMEOUT seconds, doubled on every failed probe. Once that has
+    # passed it is half open, one request per PROBE_TIMEOUT may probe it
+    # and closes it again on success. Every failure also halves the rate
+    # of the token bucket, every success raises it by RATE_STEP.
+    # Endpoints acquired with limited=False skip the token bucket, the
+    # caller bounds their concurrency itself.
+
+    FAILURE_THRESHOLD = 3
+    OPEN_TIMEOUT = 30
+    MAX_OPEN_TIMEOUT = 10 * 60
+    PROBE_TIMEOUT = 15
+    RATE = 4.0
+    MIN_RATE = 0.25
+    RATE_STEP = 0.5
+    BURST = 8
+    # requests which would wait longer for a token are refused
+    MAX_WAIT = 5
+    STATE_KEY = 'breakers'
+    STATE_TTL = 24 * 60 * 60
+
+    def __init__(self, store=None):
+        self.store = store
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint, limited=True):
+        # endpoints which are not limited only go through the breaker
+        with self._lock:
+            self._load()
+            state = self._get_state(endpoint)
+            now = time.time()
+            if state['open_until']:
+                if now < state['open_until'] or now < state['probe_until']:
+                    raise CircuitOpenError(
+                        'Circuit open for %s since %d failures'
+                        % (endpoint, state['failures'])
+                    )
+                # half open, this request is the probe
+                state['probe_until'] = now + self.PROBE_TIMEOUT
+                self._save()
+                return
+            if not limited:
+                return
+            tokens = min(
+                state['tokens'] + (now - state['updated']) * state['rate'],
+                self.BURST
+            )
+            # the token is taken now, the wait is the time until it exists
+            wait = max((1 - tokens) / state['rate'], 0)
+            if wait > self.MAX_WAIT:
+                raise RateLimitError('Rate limit of %s exceeded' % endpoint)
+            state['tokens'] = tokens - 1
+            state['updated'] = now
+            self._save()
+        if wait:
+            time.sleep(wait)
+
+    def record(self, endpoint, failed):
+        with self._lock:
+            state = self._get_state(endpoint)
+            if not failed and not state['failures'] and (
+                    state['rate'] == self.RATE):
+                # healthy before, nothing to write
+                return
+            self._load()
+            state = self._get_state(endpoint)
+            if not failed:
+                state.update(failures=0, trips=0, open_until=0,
+                             probe_until=0)
+                state['rate'] = min(state['rate'] + self.RATE_STEP,
+                                    self.RATE)
+            else:
+                state['failures'] += 1
+                state['rate'] = max(state['rate'] / 2, self.MIN_RATE)
+                if (state['open_until'] or
+                        state['failures'] >= self.FAILURE_THRESHOLD):
+                    open_for = min(self.OPEN_TIMEOUT * 2 ** state['trips'],
+                                   self.MAX_OPEN_TIMEOUT)
+                    state['trips'] += 1
+                    state['open_until'] = time.time() + open_for
+                    state['probe_until'] = 0
+            self._save()
+
+    def _get_state(self, endpoint):
+        if endpoint not in self._states:
+            self._states[endpoint] = {
+                'failures': 0, 'trips': 0, 'open_until': 0,
+                'probe_until': 0, 'rate': self.RATE, 'tokens': self.BURST,
+                'updated': time.time(),
+            }
+        return self._states[endpoint]
+
+    def _load(self):
+        # other processes may have changed it since
+        if self.store is not None:
+            self._states = self.store.get(self.STATE_KEY) or {}
+
+    def _save(self):
+        if self.store is not None:
+            self.store.set(self.STATE_KEY, self._states, self.STATE_TTL)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import sqlite3
+import threading
+import time
+
+
+class Cache():
+
+    MAX_SIZE = 16 * 1024 * 1024
+    # eviction only needs a coarse access time, hits within this many
+    # seconds of the last recorded one do not write to the database
+    ACCESS_INTERVAL = 10 * 60
+
+    def __init__(self, path, table='cache', max_size=MAX_SIZE):
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def get(self, key, allow_stale=False, min_ttl=0):
+        with self._lock:
+            row = self._execute(
+                ('SELECT value, expires, accessed FROM %s '
+                 'WHERE key = ?') % self.table,
+                (key, )
+            ).fetchone()
+            if not row:
+                return None
+            value, expires, accessed = row
+            now = time.time()
+            if expires < now + min_ttl and not allow_stale:
+                return None
+            if accessed < now - self.ACCESS_INTERVAL:
+                self._execute(
+                    'UPDATE %s SET accessed = ? WHERE key = ?' % self.table,
+                    (now, key)
+                )
+                self._conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        value = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._execute(
+                ('INSERT OR REPLACE INTO %s (key, value, size, expires, '
+                 'accessed) VALUES (?, ?, ?, ?, ?)') % self.table,
+                (key, value, len(value), now + ttl, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._execute('DELETE FROM %s WHERE key = ?' % self.table, (key, ))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._execute('DELETE FROM %s' % self.table)
+            self._conn.commit()
+
+    def _evict(self):
+        total_size = self._execute(
+            'SELECT COALESCE(SUM(size), 0) FROM %s' % self.table
+        ).fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        rows = self._execute(
+            'SELECT key, size FROM %s ORDER BY accessed' % self.table
+        ).fetchall()
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+            self._execute('DELETE FROM %s WHERE key = ?' % self.table,
+                          (key, ))
+            total_size -= size
+
+    def _execute(self, query, args=()):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10,
+                                         check_same_thread=False)
+            self._conn.execute(
+                ('CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, '
+                 'value TEXT, size INTEGER, expires REAL, accessed REAL)')
+                % self.table
+            )
+        return self._conn.execute(query, args)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# kept apart from api and transport, so callers can catch these errors
+# without importing the http stack
+
+
+class RadioApiError(Exception):
+    pass
+
+
+class StationError(RadioApiError):
+    # the stream or playlist host of a station failed, not the api
+    pass
+
+
+class CircuitOpenError(RadioApiError):
+    # the endpoint failed recently and is not asked again for a while
+    pass
+
+
+class RateLimitError(CircuitOpenError):
+    # refused by the rate limit, says nothing about the endpoint or station
+    pass
+
+
+class TransportError(Exception):
+    pass
+
+
+class TransportTimeoutError(TransportError):
+    pass
+
+
+class HTTPStatusError(TransportError):
+
+    def __init__(self, url, status, reason):
+        TransportError.__init__(self, 'HTTP Error %d: %s (%s)'
+                                % (status, reason, url))
+        self.url = url
+        self.status = status
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import os
+import sqlite3
+
+
+class MyStations():
+    # dict like favourites store, every write is a single atomic
+    # transaction so there is nothing left to sync
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._conn = None
+
+    def __contains__(self, station_id):
+        return self.get(station_id) is not None
+
+    def __getitem__(self, station_id):
+        station = self.get(station_id)
+        if station is None:
+            raise KeyError(station_id)
+        return station
+
+    def __setitem__(self, station_id, station):
+        self.update({station_id: station})
+
+    def __delitem__(self, station_id):
+        conn = self._connect()
+        with conn:
+            deleted = conn.execute('DELETE FROM stations WHERE id = ?',
+                                   (station_id, )).rowcount
+        if not deleted:
+            raise KeyError(station_id)
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM stations'
+        ).fetchone()[0]
+
+    def get(self, station_id, default=None):
+        row = self._connect().execute(
+            'SELECT data FROM stations WHERE id = ?', (station_id, )
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def update(self, stations):
+        # all stations are written in a single transaction
+        conn = self._connect()
+        with conn:
+            for station_id, station in stations.items():
+                data = json.dumps(dict(station))
+                updated = conn.execute(
+                    'UPDATE stations SET data = ? WHERE id = ?',
+                    (data, station_id)
+                ).rowcount
+                if not updated:
+                    conn.execute(
+                        'INSERT INTO stations (id, data) VALUES (?, ?)',
+                        (station_id, data)
+                    )
+
+    def keys(self):
+        return [
+            station_id for station_id, in self._connect().execute(
+                'SELECT id FROM stations ORDER BY rowid'
+            )
+        ]
+
+    def values(self):
+        return [station for station_id, station in self.items()]
+
+    def items(self):
+        return [
+            (station_id, json.loads(data))
+            for station_id, data in self._connect().execute(
+                'SELECT id, data FROM stations ORDER BY rowid'
+            )
+        ]
+
+    def sync(self):
+        pass
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS stations ('
+                    'id TEXT PRIMARY KEY, data TEXT)'
+                )
+            self._migrate()
+        return self._conn
+
+    def _migrate(self):
+        if not self.legacy_path or not os.path.isfile(self.legacy_path):
+            return
+        try:
+            stations = json.load(open(self.legacy_path))
+        except (IOError, ValueError):
+            # left in place, the import is tried again on the next start
+            return
+        with self._conn:
+            for station_id, station in stations.items():
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO stations (id, data) VALUES (?, ?)',
+                    (station_id, json.dumps(self._unwrap(station)))
+                )
+        # keep the old file as backup, but never import it again
+        os.rename(self.legacy_path, self.legacy_path + '.migrated')
+
+    @staticmethod
+    def _unwrap(value):
+        # the TimedStorage of xbmcswift2 stores [station, timestamp]
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            return value[0]
+        return value
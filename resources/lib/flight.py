@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import hashlib
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
+
+class SingleFlight():
+    # Identical calls running at the same time, in this or in another
+    # plugin process, wait for the first of them and share its result.
+    # The first caller holds a lock on a lock file while it calls
+    # upstream, its result is kept in store for RESULT_TTL seconds unless
+    # the waiting calls can look it up elsewhere (the response cache).
+    # The system releases the lock of a process which died, a caller
+    # waiting longer than timeout makes the call itself.
+
+    TIMEOUT = 15
+    POLL_INTERVAL = 0.05
+    RESULT_TTL = 10
+
+    def __init__(self, path, store, metrics=None):
+        self.path = path
+        self.store = store
+        self.metrics = metrics
+        self.calls = 0
+        self.saved = 0
+
+    def do(self, key, func, endpoint='', timeout=TIMEOUT, lookup=None):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        lock_file = os.path.join(self.path,
+                                 hashlib.sha1(key).hexdigest() + '.lock')
+        store_result = lookup is None
+        if store_result:
+            lookup = lambda: self.store.get(key)
+        deadline = time.time() + timeout
+        while True:
+            result = lookup()
+            if result is not None:
+                self.saved += 1
+                if self.metrics is not None:
+                    self.metrics.record('single_flight_saved', 0, endpoint)
+                return result
+            fd = self._acquire(lock_file)
+            if fd is not None or time.time() > deadline:
+                try:
+                    result = func()
+                    self.calls += 1
+                    if store_result:
+                        self.store.set(key, result, self.RESULT_TTL)
+                    return result
+                finally:
+                    if fd is not None:
+                        self._release(lock_file, fd)
+            # another call is in flight, if it fails the next loop makes
+            # the call itself
+            time.sleep(self.POLL_INTERVAL)
+
+    def _acquire(self, lock_file):
+        # returns the descriptor of the locked file or None
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # created by another process meanwhile
+                pass
+        fd = os.open(lock_file, os.O_CREAT | os.O_RDWR)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            # the previous holder removes the file before it unlocks it,
+            # a lock on a removed file does not count
+            if os.fstat(fd).st_ino == os.stat(lock_file).st_ino:
+                return fd
+        except (IOError, OSError):
+            pass
+        os.close(fd)
+        return None
+
+    def _release(self, lock_file, fd):
+        if fcntl is not None:
+            # removed while it is still locked, see _acquire
+            self._remove(lock_file)
+            os.close(fd)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+            # windows removes no file another process has opened
+            self._remove(lock_file)
+
+    @staticmethod
+    def _remove(lock_file):
+        try:
+            os.remove(lock_file)
+        except OSError:
+            pass
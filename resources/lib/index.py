@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import difflib
+import json
+import re
+import sqlite3
+import time
+
+from errors import RadioApiError
+
+
+class StationIndex():
+
+    # categories are harvested again after MAX_AGE, the index is used once
+    # MIN_COVERAGE of them are harvested and none is older than MAX_STALE.
+    # There are thousands of cities, they are harvested after the other
+    # category types and do not count for the coverage.
+    MAX_AGE = 7 * 24 * 60 * 60
+    MAX_STALE = 2 * MAX_AGE
+    MIN_COVERAGE = 0.9
+    OPTIONAL_TYPES = ('city', )
+    MAX_RESULTS = 500
+    REQUEST_INTERVAL = 2
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def is_fresh(self):
+        conn = self._connect()
+        if conn is None:
+            return False
+        total, harvested, oldest = conn.execute(
+            ('SELECT COUNT(*), SUM(refreshed > 0), '
+             'MIN(CASE WHEN refreshed > 0 THEN refreshed END) '
+             'FROM categories WHERE category_type NOT IN (%s)'
+             % self._placeholders(self.OPTIONAL_TYPES)),
+            self.OPTIONAL_TYPES
+        ).fetchone()
+        if not total or harvested < total * self.MIN_COVERAGE:
+            return False
+        return oldest > time.time() - self.MAX_STALE
+
+    def search(self, search_string):
+        conn = self._connect()
+        if isinstance(search_string, str):
+            search_string = search_string.decode('utf-8', 'ignore')
+        terms = re.findall(r'\w+', search_string.lower(), re.UNICODE)
+        if conn is None or not terms:
+            return []
+        stations = self._match(terms)
+        if not stations:
+            terms = [self._closest_term(term) for term in terms]
+            if None not in terms:
+                stations = self._match(terms)
+        return stations
+
+    def refresh(self, radio_api, max_categories=20, wait=None):
+        # wait(seconds) sleeps between requests and returns True to abort
+        wait = wait or (lambda seconds: time.sleep(seconds))
+        conn = self._connect()
+        if conn is None:
+            return 0
+        now = time.time()
+        listed = conn.execute(
+            "SELECT value FROM state WHERE key = 'categories_listed'"
+        ).fetchone()
+        if not listed or float(listed[0]) < now - self.MAX_AGE:
+            try:
+                self._list_categories(radio_api)
+            except RadioApiError, error:
+                # most likely offline, tried again on the next run
+                conn.rollback()
+                radio_api.log('index refresh stopped: %s' % error)
+                return 0
+        categories = conn.execute(
+            ('SELECT category_type, category FROM categories '
+             'WHERE refreshed < ? ORDER BY category_type IN (%s), refreshed '
+             'LIMIT ?' % self._placeholders(self.OPTIONAL_TYPES)),
+            (now - self.MAX_AGE, ) + self.OPTIONAL_TYPES + (max_categories, )
+        ).fetchall()
+        num_refreshed = 0
+        for category_type, category in categories:
+            if wait(self.REQUEST_INTERVAL):
+                break
+            try:
+                stations = radio_api.get_stations_by_category(
+                    category_type, category.encode('utf-8')
+                )
+            except RadioApiError:
+                break
+            self._add_stations(stations, category)
+            conn.execute(
+                ('UPDATE categories SET refreshed = ? '
+                 'WHERE category_type = ? AND category = ?'),
+                (time.time(), category_type, category)
+            )
+            conn.commit()
+            num_refreshed += 1
+        conn.execute('DELETE FROM stations WHERE seen < ?',
+                     (now - 2 * self.MAX_AGE, ))
+        conn.execute('DELETE FROM station_fts WHERE docid NOT IN '
+                     '(SELECT rowid FROM stations)')
+        conn.commit()
+        return num_refreshed
+
+    def _match(self, terms):
+        query = ' '.join('%s*' % term for term in terms)
+        rows = self._conn.execute(
+            ('SELECT s.data FROM station_fts f JOIN stations s '
+             'ON s.rowid = f.docid WHERE station_fts MATCH ? '
+             'ORDER BY s.rating DESC LIMIT ?'),
+            (query, self.MAX_RESULTS)
+        ).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def _closest_term(self, term):
+        terms = [
+            t for t, in self._conn.execute(
+                "SELECT DISTINCT term FROM station_terms WHERE col = '*'"
+            )
+        ]
+        matches = difflib.get_close_matches(term, terms, n=1, cutoff=0.75)
+        return matches[0] if matches else None
+
+    def _list_categories(self, radio_api):
+        for category_type in radio_api.get_category_types():
+            for category in radio_api.get_categories(category_type):
+                self._conn.execute(
+                    ('INSERT OR IGNORE INTO categories (category_type, '
+                     'category, refreshed) VALUES (?, ?, 0)'),
+                    (category_type, category)
+                )
+        self._conn.execute(
+            'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+            ('categories_listed', str(time.time()))
+        )
+        self._conn.commit()
+
+    def _add_stations(self, stations, category):
+        now = time.time()
+        for station in stations:
+            station_id = str(station['id'])
+            row = self._conn.execute(
+                'SELECT rowid, keywords FROM stations WHERE id = ?',
+                (station_id, )
+            ).fetchone()
+            keywords = set(row[1].split('|')) if row else set()
+            keywords.add(category)
+            keywords = '|'.join(sorted(keywords))
+            rating = float(station.get('rating') or 0)
+            args = (station_id, station['name'], rating, keywords,
+                    json.dumps(dict(station)), now)
+            if row:
+                self._conn.execute(
+                    ('UPDATE stations SET id = ?, name = ?, rating = ?, '
+                     'keywords = ?, data = ?, seen = ? WHERE rowid = ?'),
+                    args + (row[0], )
+                )
+                self._conn.execute('DELETE FROM station_fts WHERE docid = ?',
+                                   (row[0], ))
+                rowid = row[0]
+            else:
+                rowid = self._conn.execute(
+                    ('INSERT INTO stations (id, name, rating, keywords, '
+                     'data, seen) VALUES (?, ?, ?, ?, ?, ?)'),
+                    args
+                ).lastrowid
+            self._conn.execute(
+                ('INSERT INTO station_fts (docid, name, keywords) '
+                 'VALUES (?, ?, ?)'),
+                (rowid, station['name'], keywords.replace('|', ' '))
+            )
+
+    @staticmethod
+    def _placeholders(values):
+        return ', '.join('?' * len(values))
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.executescript(
+                'CREATE TABLE IF NOT EXISTS stations ('
+                '    id TEXT UNIQUE, name TEXT, rating REAL,'
+                '    keywords TEXT, data TEXT, seen REAL);'
+                'CREATE TABLE IF NOT EXISTS categories ('
+                '    category_type TEXT, category TEXT, refreshed REAL,'
+                '    PRIMARY KEY (category_type, category));'
+                'CREATE TABLE IF NOT EXISTS state ('
+                '    key TEXT PRIMARY KEY, value TEXT);'
+            )
+            # unicode61 folds case and accents of non-ascii names as well
+            for tokenizer in ('unicode61', 'simple'):
+                try:
+                    conn.executescript(
+                        ('CREATE VIRTUAL TABLE IF NOT EXISTS station_fts '
+                         '    USING fts4(name, keywords, tokenize=%s);'
+                         'CREATE VIRTUAL TABLE IF NOT EXISTS station_terms '
+                         '    USING fts4aux(station_fts);') % tokenizer
+                    )
+                except sqlite3.OperationalError:
+                    continue
+                self._conn = conn
+                break
+            else:
+                # sqlite built without fts4, searches stay remote
+                conn.close()
+        return self._conn
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+
+class _NullSpan():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Span():
+
+    def __init__(self, metrics, name, endpoint):
+        self.metrics = metrics
+        self.name = name
+        self.endpoint = endpoint
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.time() - self.start,
+                            self.endpoint, error=exc_type is not None)
+        return False
+
+
+class Metrics():
+    # Timing spans, written as json lines to a rotating span log and
+    # aggregated into per endpoint counters and histograms on flush().
+    # Disabled instances cost one attribute lookup per span.
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    MAX_LOG_SIZE = 512 * 1024
+    LOG_BACKUPS = 3
+
+    _null_span = _NullSpan()
+
+    def __init__(self, path=None, enabled=False):
+        self.path = path
+        self.enabled = enabled and path is not None
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def span(self, name, endpoint=''):
+        if not self.enabled:
+            return self._null_span
+        return _Span(self, name, endpoint)
+
+    def timed(self, name):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, duration, endpoint='', error=False):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._spans.append({
+                'time': round(time.time(), 3),
+                'pid': os.getpid(),
+                'name': name,
+                'endpoint': endpoint,
+                'duration': round(duration, 6),
+                'error': error,
+            })
+
+    def flush(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._write_spans(spans)
+        self._write_summary(spans)
+
+    def _write_spans(self, spans):
+        log_file = os.path.join(self.path, 'spans.log')
+        if (os.path.isfile(log_file) and
+                os.path.getsize(log_file) > self.MAX_LOG_SIZE):
+            for i in xrange(self.LOG_BACKUPS - 1, 0, -1):
+                if os.path.isfile('%s.%d' % (log_file, i)):
+                    self._replace('%s.%d' % (log_file, i),
+                                  '%s.%d' % (log_file, i + 1))
+            self._replace(log_file, '%s.1' % log_file)
+        with open(log_file, 'a') as f:
+            for span in spans:
+                f.write(json.dumps(span) + '\n')
+
+    def _write_summary(self, spans):
+        summary_file = os.path.join(self.path, 'summary.json')
+        try:
+            summary = json.load(open(summary_file))
+        except (IOError, ValueError):
+            summary = {}
+        for span in spans:
+            key = '%s %s' % (span['name'], span['endpoint'])
+            entry = summary.setdefault(key, {
+                'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                'buckets': [0] * (len(self.BUCKETS) + 1),
+            })
+            entry['count'] += 1
+            entry['errors'] += span['error']
+            entry['total'] += span['duration']
+            entry['max'] = max(entry['max'], span['duration'])
+            for i, bound in enumerate(self.BUCKETS):
+                if span['duration'] <= bound:
+                    break
+            else:
+                i = len(self.BUCKETS)
+            entry['buckets'][i] += 1
+        summary['_buckets'] = self.BUCKETS
+        tmp_file = summary_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        self._replace(tmp_file, summary_file)
+
+    @staticmethod
+    def _replace(src, dst):
+        # os.rename does not overwrite on windows
+        if os.name == 'nt' and os.path.isfile(dst):
+            os.remove(dst)
+        os.rename(src, dst)
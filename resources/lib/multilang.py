@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+from api import RadioApi
+from asyncapi import AsyncRadioApi
+from errors import RadioApiError
+
+
+class MultiLanguageApi():
+    # One RadioApi per backend (rad.io, radio.de, radio.fr) side by side.
+    # They share cache, transport, prober and metrics, cached responses
+    # are keyed by api url, so no language evicts the state of another.
+
+    def __init__(self, radio_api):
+        self.radio_api = radio_api
+        self._apis = {radio_api.language: radio_api}
+        self._async_api = None
+
+    def get_api(self, language):
+        if language not in self._apis:
+            api = RadioApi(language, self.radio_api.user_agent,
+                           cache=self.radio_api.cache,
+                           transport=self.radio_api.transport,
+                           probe_servers=self.radio_api.probe_servers,
+                           metrics=self.radio_api.metrics)
+            api.set_timeout(self.radio_api.timeout)
+            api.refresh_ahead = self.radio_api.refresh_ahead
+            api.prober = self.radio_api.prober
+            api.single_flight = self.radio_api.single_flight
+            api.breaker = self.radio_api.breaker
+            api.log = self.radio_api.log
+            self._apis[language] = api
+        return self._apis[language]
+
+    def get_languages(self):
+        # the configured language first, its stations win on duplicates
+        return [self.radio_api.language] + sorted(
+            language for language in RadioApi.MAIN_URLS
+            if language != self.radio_api.language
+        )
+
+    def get_top_stations(self, languages=None):
+        return self.merged('get_top_stations', (), languages)
+
+    def get_recommendation_stations(self, languages=None):
+        return self.merged('get_recommendation_stations', (), languages)
+
+    def search_stations_by_string(self, search_string, languages=None):
+        return self.merged('search_stations_by_string', (search_string, ),
+                           languages)
+
+    def merged(self, method, args=(), languages=None):
+        # all backends are asked concurrently, stations are merged by id
+        languages = languages or self.get_languages()
+        if self._async_api is None:
+            # creates the transport all languages share
+            self._async_api = AsyncRadioApi(self.radio_api)
+        futures = [
+            self._async_api.submit(getattr(self.get_api(language), method),
+                                   *args)
+            for language in languages
+        ]
+        results = AsyncRadioApi.gather(futures)
+        errors = [result for result in results
+                  if isinstance(result, Exception)]
+        if len(errors) == len(results):
+            raise RadioApiError('All backends failed: %s' % errors[0])
+        stations = []
+        station_ids = set()
+        for language, result in zip(languages, results):
+            if isinstance(result, Exception):
+                self.radio_api.log('merged %s failed for %s: %s'
+                                   % (method, language, result))
+                continue
+            for station in result:
+                if station['id'] not in station_ids:
+                    station_ids.add(station['id'])
+                    stations.append(station)
+        return stations
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+
+
+class NowPlayingPoller():
+    # Polls the current track of the playing and of the favourite stations.
+    # Stations due at about the same time are fetched in one batch, the
+    # interval of a station grows while its track does not change and only
+    # changed tracks are published.
+
+    ACTIVE_INTERVALS = (15, 60)
+    FAVOURITE_INTERVALS = (2 * 60, 15 * 60)
+    BACKOFF = 2
+    # stations due within this many seconds join the current batch
+    COALESCE_WINDOW = 10
+
+    def __init__(self, radio_api, publish):
+        self.radio_api = radio_api
+        self.publish = publish
+        self.active_id = None
+        self._stations = {}
+
+    def set_stations(self, active_id, favourite_ids):
+        now = time.time()
+        station_ids = set(str(station_id) for station_id in favourite_ids)
+        if active_id:
+            station_ids.add(str(active_id))
+            if str(active_id) != self.active_id:
+                # a new station is playing, poll it right away
+                self._stations.pop(str(active_id), None)
+        self.active_id = str(active_id) if active_id else None
+        for station_id in set(self._stations) - station_ids:
+            del self._stations[station_id]
+        for station_id in station_ids - set(self._stations):
+            self._stations[station_id] = {
+                'track': None,
+                'interval': self._get_intervals(station_id)[0],
+                'due': now,
+            }
+
+    def next_delay(self):
+        if not self._stations:
+            return None
+        due = min(state['due'] for state in self._stations.values())
+        return max(due - time.time(), 0)
+
+    def poll(self):
+        now = time.time()
+        station_ids = [
+            station_id for station_id, state in self._stations.items()
+            if state['due'] <= now + self.COALESCE_WINDOW
+        ]
+        if not station_ids:
+            return 0
+        tracks = dict(
+            (str(station['id']), station['current_track'])
+            for station in self.radio_api.get_stations_by_ids(station_ids)
+        )
+        num_changed = 0
+        for station_id in station_ids:
+            state = self._stations[station_id]
+            min_interval, max_interval = self._get_intervals(station_id)
+            track = tracks.get(station_id)
+            if track is not None and track != state['track']:
+                state['track'] = track
+                state['interval'] = min_interval
+                self.publish(station_id, track)
+                num_changed += 1
+            else:
+                # unchanged or failed, either way ask less often
+                state['interval'] = min(state['interval'] * self.BACKOFF,
+                                        max_interval)
+            state['due'] = time.time() + state['interval']
+        return num_changed
+
+    def _get_intervals(self, station_id):
+        if station_id == self.active_id:
+            return self.ACTIVE_INTERVALS
+        return self.FAVOURITE_INTERVALS
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import re
+from urlparse import urljoin, urlsplit
+
+from errors import TransportError
+
+# (format, content types, url suffixes, pattern matching the head of the
+# body), detection tries the body first, then content type, then suffix
+FORMATS = (
+    ('hls', ('application/vnd.apple.mpegurl', ), ('.m3u8', ),
+     re.compile(r'^#EXT-X-', re.M)),
+    ('pls', ('audio/x-scpls', 'audio/scpls'), ('.pls', ),
+     re.compile(r'^\s*\[playlist\]', re.I)),
+    ('asx', ('video/x-ms-asf', 'audio/x-ms-asx', 'video/x-ms-asx'),
+     ('.asx', '.wax', '.wvx'),
+     re.compile(r'^\s*<asx[\s>]', re.I)),
+    ('xspf', ('application/xspf+xml', ), ('.xspf', ),
+     re.compile(r'^\s*(<\?xml[^>]*>\s*)?<playlist[^>]*xspf', re.I)),
+    ('m3u', ('audio/x-mpegurl', 'audio/mpegurl', 'application/x-mpegurl'),
+     ('.m3u', ),
+     re.compile(r'^\s*(#EXTM3U|(https?|mms|rtsp)://)', re.I)),
+)
+# playlists are small, anything bigger is no playlist or garbage
+MAX_SIZE = 32 * 1024
+MAX_DEPTH = 3
+
+_PLS_FILE = re.compile(r'^\s*file(\d+)\s*=\s*(\S.*?)\s*$', re.I | re.M)
+_ASX_REF = re.compile(
+    r'<(?:ref|entryref)\s[^>]*?href\s*=\s*["\']?([^"\'>\s]+)', re.I
+)
+_XSPF_LOCATION = re.compile(r'<location>\s*([^<\s][^<]*?)\s*</location>',
+                            re.I)
+# an m3u entry is an url or a path, error pages give lines of prose
+_M3U_ENTRY = re.compile(
+    r'^(?:[a-z][a-z0-9+.-]*://|[^\s<>"#]*[./])[^\s<>"]*$', re.I
+)
+_STREAM_TYPES = ('audio/', 'video/', 'application/ogg')
+_URL_SCHEMES = ('http', 'https', 'mms', 'mmsh', 'rtsp', 'rtmp')
+
+
+def detect(head, content_type='', url=''):
+    head = head.lstrip('\xef\xbb\xbf')
+    for name, content_types, suffixes, pattern in FORMATS:
+        if pattern.search(head, 0, 1024):
+            return name
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    path = urlsplit(url).path.lower()
+    for name, content_types, suffixes, pattern in FORMATS:
+        if content_type in content_types or path.endswith(suffixes):
+            return name
+    return None
+
+
+def parse(body, content_type='', url=''):
+    # returns the ranked stream urls, or None if body is no playlist
+    body = body.lstrip('\xef\xbb\xbf')
+    playlist_format = detect(body, content_type, url)
+    if playlist_format is None:
+        return None
+    if playlist_format == 'hls':
+        # kodi plays hls itself, the playlist url is the stream
+        urls = [url]
+    elif playlist_format == 'pls':
+        urls = [
+            entry for number, entry in
+            sorted(_PLS_FILE.findall(body), key=lambda m: int(m[0]))
+        ]
+    elif playlist_format == 'asx':
+        urls = [_unescape(entry) for entry in _ASX_REF.findall(body)]
+    elif playlist_format == 'xspf':
+        urls = [_unescape(entry) for entry in _XSPF_LOCATION.findall(body)]
+    else:
+        urls = [
+            line.strip() for line in body.splitlines()
+            if _M3U_ENTRY.match(line.strip())
+        ]
+    return rank([
+        entry if '://' in entry else urljoin(url, entry) for entry in urls
+    ])
+
+
+def rank(urls):
+    # first occurrence wins, streams kodi plays best (http) come first
+    seen = set()
+    ranked = []
+    for url in urls:
+        scheme = url.split('://', 1)[0].lower()
+        if url in seen or scheme not in _URL_SCHEMES:
+            continue
+        seen.add(url)
+        ranked.append(url)
+    ranked.sort(key=lambda url: not url.lower().startswith('http'))
+    return ranked
+
+
+def is_playlist_url(url):
+    path = urlsplit(url).path.lower()
+    return any(
+        path.endswith(suffixes)
+        for name, content_types, suffixes, pattern in FORMATS
+        if name != 'hls'
+    )
+
+
+class PlaylistResolver():
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def resolve(self, url):
+        return self._resolve(url, set([url]))
+
+    def _resolve(self, url, parents):
+        # only the head of a response is read, an url which turns out to
+        # be an audio stream is returned as it is, without reading it
+        response = self.transport.request(
+            url, read_body=lambda headers: not _is_stream(
+                headers.get('content-type', '')
+            ), max_size=MAX_SIZE
+        )
+        content_type = response.headers.get('content-type', '')
+        urls = None
+        if not _is_stream(content_type):
+            urls = parse(response.read(), content_type, response.geturl())
+        if urls is None:
+            return [response.geturl()]
+        resolved = []
+        for entry in urls:
+            if entry in parents:
+                # playlists referencing each other
+                continue
+            if len(parents) <= MAX_DEPTH and is_playlist_url(entry):
+                try:
+                    resolved.extend(
+                        self._resolve(entry, parents | set([entry]))
+                    )
+                except TransportError:
+                    continue
+            else:
+                resolved.append(entry)
+        return rank(resolved)
+
+
+def _is_stream(content_type):
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    return content_type.startswith(_STREAM_TYPES) and not any(
+        content_type in content_types
+        for name, content_types, suffixes, pattern in FORMATS
+    )
+
+
+def _unescape(text):
+    return (text.replace('&lt;', '<').replace('&gt;', '>')
+            .replace('&quot;', '"').replace('&apos;', "'")
+            .replace('&amp;', '&'))
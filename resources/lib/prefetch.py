@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+import time
+from Queue import Queue, Empty
+
+from errors import RadioApiError, StationError
+
+
+class StreamPrefetcher():
+    # Resolved stream urls by station id. Entries older than
+    # REVALIDATE_AFTER are checked with a HEAD request before they are
+    # used again, stations whose stream or playlist host fails are not
+    # tried again before their (exponentially growing) backoff has passed.
+
+    TTL = 60 * 60
+    REVALIDATE_AFTER = 5 * 60
+    REVALIDATE_TIMEOUT = 3
+    FAILURE_BACKOFF = 30
+    MAX_FAILURE_BACKOFF = 60 * 60
+    WORKERS = 3
+
+    def __init__(self, radio_api, cache, workers=WORKERS):
+        self.radio_api = radio_api
+        self.cache = cache
+        self.workers = workers
+        self._queue = Queue()
+        self._threads = []
+
+    def get_stream_url(self, station_id):
+        entry = self.cache.get(str(station_id))
+        if entry is None:
+            return self.resolve(station_id)
+        if entry['failures']:
+            retry_in = entry['retry_at'] - time.time()
+            if retry_in > 0:
+                raise RadioApiError('Station %s failed %d times, next try '
+                                    'in %d s' % (station_id,
+                                                 entry['failures'], retry_in))
+            return self.resolve(station_id, entry['failures'])
+        if time.time() - entry['validated'] < self.REVALIDATE_AFTER:
+            return entry['stream_url']
+        if self.radio_api.check_stream_url(entry['stream_url'],
+                                           self.REVALIDATE_TIMEOUT):
+            self.store(station_id, entry['stream_url'])
+            return entry['stream_url']
+        return self.resolve(station_id)
+
+    def resolve(self, station_id, failures=0):
+        # only failures of the station itself are remembered, the next
+        # request may already reach an api which failed just now
+        try:
+            station = self.radio_api.get_station_by_station_id(station_id)
+            if not station['stream_url']:
+                raise StationError('No stream url for station %s'
+                                   % station_id)
+        except StationError:
+            self._store_failure(station_id, failures + 1)
+            raise
+        self.store(station_id, station['stream_url'])
+        return station['stream_url']
+
+    def store(self, station_id, stream_url):
+        if stream_url:
+            self.cache.set(str(station_id), {
+                'stream_url': stream_url,
+                'validated': time.time(),
+                'failures': 0,
+            }, self.TTL)
+
+    def prefetch(self, station_ids):
+        queued = 0
+        for station_id in station_ids:
+            if not self._is_current(self.cache.get(str(station_id))):
+                self._queue.put(station_id)
+                queued += 1
+        while len(self._threads) < min(self.workers, queued):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return queued
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0))
+        # whatever is still queued is dropped with the process
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+
+    def _is_current(self, entry):
+        # known good or known broken, nothing to do ahead of time
+        if entry is None:
+            return False
+        if entry['failures']:
+            return entry['retry_at'] > time.time()
+        return time.time() - entry['validated'] < self.REVALIDATE_AFTER
+
+    def _store_failure(self, station_id, failures):
+        backoff = min(self.FAILURE_BACKOFF * 2 ** (failures - 1),
+                      self.MAX_FAILURE_BACKOFF)
+        self.cache.set(str(station_id), {
+            'stream_url': None,
+            'retry_at': time.time() + backoff,
+            'failures': failures,
+        }, self.MAX_FAILURE_BACKOFF * 2)
+
+    def _work(self):
+        while True:
+            try:
+                station_id = self._queue.get_nowait()
+            except Empty:
+                return
+            try:
+                self.get_stream_url(station_id)
+            except Exception, error:
+                self.radio_api.log('prefetch of station %s failed: %s'
+                                   % (station_id, error))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import random
+import threading
+import time
+from Queue import Queue, Empty
+from urlparse import urlsplit
+
+from errors import TransportError
+
+
+class ServerProber():
+
+    TIMEOUT = 3
+    MAX_PARALLEL = 4
+    AUDIO_TYPES = (
+        'audio/', 'application/ogg', 'application/octet-stream', 'video/nsv',
+    )
+    # assumed latency of hosts without history, between good and failed ones
+    UNKNOWN_LATENCY = 1.0
+    FAILURE_PENALTY = 10.0
+    STATS_KEY = 'host_stats'
+    STATS_TTL = 7 * 24 * 60 * 60
+
+    def __init__(self, transport, store=None):
+        self.transport = transport
+        self.store = store
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def select(self, servers):
+        candidates = self.rank(servers)[:self.MAX_PARALLEL]
+        results = Queue()
+        for url in candidates:
+            thread = threading.Thread(target=self._probe, args=(url, results))
+            thread.daemon = True
+            thread.start()
+        deadline = time.time() + self.TIMEOUT
+        winner = None
+        pending = len(candidates)
+        while pending and not winner:
+            try:
+                url, latency, healthy = results.get(
+                    timeout=max(deadline - time.time(), 0)
+                )
+            except Empty:
+                break
+            pending -= 1
+            self._record(url, latency, healthy)
+            if healthy:
+                winner = url
+        self._save()
+        return winner
+
+    def rank(self, servers):
+        servers = list(servers)
+        # equally ranked servers keep spreading the load like before
+        random.shuffle(servers)
+        return sorted(servers, key=self._score)
+
+    def _probe(self, url, results):
+        start = time.time()
+        try:
+            response = self.transport.request(url, read_body=False,
+                                              timeout=self.TIMEOUT)
+            content_type = response.headers.get('content-type', '').lower()
+            # ICY servers answer without (parsable) HTTP headers
+            healthy = not content_type or content_type.startswith(
+                self.AUDIO_TYPES
+            )
+        except TransportError:
+            healthy = False
+        results.put((url, time.time() - start, healthy))
+
+    def _score(self, url):
+        latency, failures = self._get_stats().get(
+            self._host(url), (self.UNKNOWN_LATENCY, 0)
+        )
+        return latency + failures * self.FAILURE_PENALTY
+
+    def _record(self, url, latency, healthy):
+        stats = self._get_stats()
+        host = self._host(url)
+        with self._lock:
+            old_latency, failures = stats.get(host, (latency, 0))
+            if healthy:
+                stats[host] = (0.7 * old_latency + 0.3 * latency, 0)
+            else:
+                stats[host] = (old_latency, failures + 1)
+
+    def _get_stats(self):
+        if self._stats is None:
+            stats = None
+            if self.store is not None:
+                stats = self.store.get(self.STATS_KEY)
+            self._stats = dict(
+                (host, tuple(value)) for host, value in (stats or {}).items()
+            )
+        return self._stats
+
+    def _save(self):
+        if self.store is not None:
+            with self._lock:
+                self.store.set(self.STATS_KEY, self._stats, self.STATS_TTL)
+
+    @staticmethod
+    def _host(url):
+        return urlsplit(url).netloc.lower()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+try:
+    # with its C speedups about twice as fast as the json module of
+    # python 2.7, ascii strings are decoded to str instead of unicode
+    from simplejson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+
+def loads(text, marker, fields):
+    # Every object containing the marker key is reduced to fields right
+    # after it was decoded, so the unused values of one object are freed
+    # before the next one is read. Objects nested in a reduced object are
+    # still decoded completely.
+    def object_hook(obj):
+        if marker in obj:
+            return dict((key, obj[key]) for key in fields if key in obj)
+        return obj
+    return _loads(text, object_hook=object_hook)
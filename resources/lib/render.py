@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+from urllib import quote_plus
+
+
+class ItemRenderer():
+    # Builds the Kodi list items of stations. The urls of an endpoint only
+    # differ in the station id, so url_for is called once per endpoint and
+    # the quoted station id (like url_for quotes it) is put into its
+    # result for every station.
+
+    PLACEHOLDER = '__station_id__'
+
+    def __init__(self, url_for, get_string):
+        self.url_for = url_for
+        self.get_string = get_string
+        self._templates = {}
+
+    def _url(self, endpoint, quoted_id):
+        template = self._templates.get(endpoint)
+        if template is None:
+            template = self.url_for(endpoint, station_id=self.PLACEHOLDER)
+            self._templates[endpoint] = template
+        return template.replace(self.PLACEHOLDER, quoted_id)
+
+    def render(self, stations, favourite_ids, thumbnails=None, offset=0):
+        thumbnails = thumbnails or {}
+        add_label = self.get_string('add_to_my_stations')
+        remove_label = self.get_string('remove_from_my_stations')
+        edit_label = self.get_string('edit_custom_station')
+        items = []
+        for i, station in enumerate(stations, offset):
+            station_id = str(station['id'])
+            quoted_id = quote_plus(station_id)
+            if station_id in favourite_ids:
+                context_menu = [(remove_label, 'XBMC.RunPlugin(%s)'
+                                 % self._url('del_from_my_stations',
+                                             quoted_id))]
+            else:
+                context_menu = [(add_label, 'XBMC.RunPlugin(%s)'
+                                 % self._url('add_to_my_stations',
+                                             quoted_id))]
+            if station.get('is_custom', False):
+                context_menu.append((edit_label, 'XBMC.RunPlugin(%s)'
+                                     % self._url('custom_my_station',
+                                                 quoted_id)))
+            name = station.get('name', '')
+            thumbnail = station['thumbnail']
+            items.append({
+                'label': name,
+                'thumbnail': thumbnails.get(thumbnail, thumbnail),
+                'info': {
+                    'title': name,
+                    'rating': str(station.get('rating', '0.0')),
+                    'genre': station.get('genre', ''),
+                    'size': int(station.get('bitrate', 0)),
+                    'comment': station.get('current_track', ''),
+                    'count': i,
+                },
+                'context_menu': context_menu,
+                'path': self._url('get_stream_url', quoted_id),
+                'is_playable': True,
+            })
+        return items
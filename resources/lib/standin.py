@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Local stand-in for the radio.de API and the stream servers, used by
+# bench.py so measurements do not depend on the real network.
+#
+import json
+import os
+import re
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qsl, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+
+PLAYLIST_TYPES = {
+    'm3u': 'audio/x-mpegurl',
+    'pls': 'audio/x-scpls',
+    'asx': 'video/x-ms-asf',
+}
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # buffer the response so headers do not trigger delayed ACK stalls
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+        # simulates the round trips of a TCP (and TLS) handshake
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        with self.server.lock:
+            self.server.requests += 1
+        route = self.server.routes.get(self.path)
+        if route is None:
+            route = self.server.routes.get(urlsplit(self.path).path)
+        if route is None:
+            route = (404, {'Content-Type': 'text/plain'}, 'not found')
+        if callable(route):
+            route = route(self)
+        status, headers, body = route
+        if self.server.response_delay:
+            time.sleep(self.server.response_delay)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if body is None:
+            # endless body like a real audio stream, the client hangs up
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            if send_body:
+                try:
+                    while True:
+                        self.wfile.write('\0' * 4096)
+                        self.wfile.flush()
+                        time.sleep(0.01)
+                except Exception:
+                    pass
+            self.close_connection = 1
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, routes=None, handshake_delay=0.0, response_delay=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandinHandler)
+        self.routes = routes or {}
+        self.handshake_delay = handshake_delay
+        self.response_delay = response_delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on endless streams are expected
+        pass
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+
+    def url(self, path=''):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+
+def fixture_routes(server):
+    # replays the recorded responses in fixtures/api and fixtures/playlists,
+    # {server} in a fixture is replaced with the url of the stand-in server
+    routes = {}
+    api_dir = os.path.join(FIXTURES, 'api')
+    for root, dirs, files in os.walk(api_dir):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+            path = os.path.relpath(file_path, api_dir)[:-len('.json')]
+            routes['/info/%s' % path.replace(os.sep, '/')] = (
+                200, {'Content-Type': 'application/json'},
+                open(file_path).read().replace('{server}', server.url())
+            )
+    stations = json.loads(routes['/info/broadcast/getbroadcastembedded'][2])
+
+    def get_broadcast(handler):
+        query = dict(parse_qsl(urlsplit(handler.path).query))
+        for station in stations:
+            if str(station['id']) == query.get('broadcast'):
+                return (200, {'Content-Type': 'application/json'},
+                        json.dumps(station))
+        return 404, {'Content-Type': 'text/plain'}, 'unknown broadcast'
+
+    routes['/info/broadcast/getbroadcastembedded'] = get_broadcast
+    playlist_dir = os.path.join(FIXTURES, 'playlists')
+    for filename in os.listdir(playlist_dir):
+        body = open(os.path.join(playlist_dir, filename)).read()
+        body = body.replace('{server}', server.url())
+        content_type = PLAYLIST_TYPES.get(filename.rsplit('.', 1)[-1],
+                                          'text/plain')
+        routes['/playlists/%s' % filename] = (
+            200, {'Content-Type': content_type}, body
+        )
+        for stream_path in re.findall(r'/stream/[\w.-]+', body):
+            routes[stream_path] = (200, {'Content-Type': 'audio/mpeg'}, None)
+    return routes
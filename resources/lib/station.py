@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# the same few picture base urls are shared by all stations
+_picture_bases = {}
+
+
+class Station(object):
+    # Compact station record, behaves like the station dicts it replaces
+    # (station['name'], station.get(...), dict(station)) so stored and
+    # custom stations (plain dicts) can be handled the same way.
+
+    FIELDS = (
+        'name', 'thumbnail', 'rating', 'genre', 'bitrate', 'id',
+        'current_track', 'stream_url', 'description',
+    )
+    _FIELD_SET = frozenset(FIELDS)
+
+    # the broadcast fields from_api() reads
+    API_FIELDS = (
+        'name', 'rating', 'bitrate', 'id', 'currentTrack', 'streamURL',
+        'description', 'pictureBaseURL', 'picture4TransName', 'picture4Name',
+        'picture1TransName', 'picture1Name', 'genresAndTopics', 'genres',
+        'topics',
+    )
+
+    __slots__ = (
+        'name', 'rating', 'bitrate', 'id', 'current_track', 'stream_url',
+        'description', '_picture_base', '_picture', '_genres',
+    )
+
+    def __init__(self, name, rating, bitrate, id, current_track,
+                 stream_url='', description='', picture_base='',
+                 picture='', genres=''):
+        self.name = name
+        self.rating = rating
+        self.bitrate = bitrate
+        self.id = id
+        self.current_track = current_track
+        self.stream_url = stream_url
+        self.description = description
+        self._picture_base = picture_base
+        self._picture = picture
+        self._genres = genres
+
+    @classmethod
+    def from_api(cls, station):
+        picture = (
+            station.get('picture4TransName') or
+            station.get('picture4Name') or
+            station.get('picture1TransName').replace('_1_', '_4_') or
+            station.get('picture1Name').replace('_1_', '_4_')
+        )
+        genres = station.get('genresAndTopics') or tuple(
+            station.get('genres', []) + station.get('topics', [])
+        )
+        return cls(
+            name=station['name'],
+            rating=station['rating'],
+            bitrate=station['bitrate'],
+            id=station['id'],
+            current_track=station['currentTrack'],
+            stream_url=station.get('streamURL', ''),
+            description=station.get('description', ''),
+            picture_base=_picture_bases.setdefault(
+                station['pictureBaseURL'], station['pictureBaseURL']
+            ),
+            picture=picture,
+            genres=genres,
+        )
+
+    @property
+    def thumbnail(self):
+        return self._picture_base + self._picture
+
+    @property
+    def genre(self):
+        if isinstance(self._genres, tuple):
+            return ','.join(self._genres)
+        return self._genres
+
+    def __getitem__(self, key):
+        if key not in self._FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._FIELD_SET
+
+    def get(self, key, default=None):
+        if key not in self._FIELD_SET:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.FIELDS)
+
+    def __repr__(self):
+        return 'Station(id=%r, name=%r)' % (self.id, self.name)
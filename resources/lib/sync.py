@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import random
+import time
+
+from errors import RadioApiError
+
+
+class CatalogueSync():
+    # Refreshes the category lists and the station lists of the most
+    # visited categories into the api cache, ahead of their expiry, so
+    # the plugin finds them there (and keeps the stale copies offline).
+
+    INTERVAL = 30 * 60
+    JITTER = 5 * 60
+    REQUEST_INTERVAL = 2
+    MAX_CATEGORIES = 10
+    VISITS_KEY = 'category_visits'
+    VISITS_TTL = 30 * 24 * 60 * 60
+
+    def __init__(self, radio_api, store):
+        self.radio_api = radio_api
+        self.store = store
+
+    def record_visit(self, category_type, category):
+        if isinstance(category, str):
+            category = category.decode('utf-8')
+        now = time.time()
+        visits = dict(
+            (key, visit) for key, visit in self._get_visits().items()
+            if visit[1] > now - self.VISITS_TTL
+        )
+        key = '%s/%s' % (category_type, category)
+        visits[key] = (visits.get(key, (0, now))[0] + 1, now)
+        self.store.set(self.VISITS_KEY, visits, self.VISITS_TTL)
+
+    def most_visited(self, count=MAX_CATEGORIES):
+        visits = sorted(self._get_visits().items(),
+                        key=lambda item: item[1][0], reverse=True)
+        return [tuple(key.split('/', 1)) for key, visit in visits[:count]]
+
+    def next_delay(self):
+        return self.INTERVAL + random.uniform(-self.JITTER, self.JITTER)
+
+    def run(self, wait=None):
+        # wait(seconds) sleeps between requests and returns True to abort
+        wait = wait or (lambda seconds: time.sleep(seconds))
+        requests = [
+            (self.radio_api.get_categories, (category_type, ))
+            for category_type in self.radio_api.get_category_types()
+        ] + [
+            (self.radio_api.get_stations_by_category,
+             (category_type, category.encode('utf-8')))
+            for category_type, category in self.most_visited()
+        ]
+        refresh_ahead = self.radio_api.refresh_ahead
+        # everything expiring before the next run is refreshed now
+        self.radio_api.refresh_ahead = self.INTERVAL + self.JITTER
+        num_requests = 0
+        try:
+            for func, args in requests:
+                if num_requests and wait(self.REQUEST_INTERVAL):
+                    break
+                try:
+                    func(*args)
+                except RadioApiError, error:
+                    # most likely offline, the cached lists stay in place
+                    self.radio_api.log('sync stopped: %s' % error)
+                    break
+                num_requests += 1
+        finally:
+            self.radio_api.refresh_ahead = refresh_ahead
+        return num_requests
+
+    def _get_visits(self):
+        return self.store.get(self.VISITS_KEY) or {}
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import httplib
+import socket
+import threading
+import zlib
+from urlparse import urljoin, urlsplit
+
+from errors import (HTTPStatusError, TransportError,
+                    TransportTimeoutError)
+
+
+class Response():
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def geturl(self):
+        return self.url
+
+    def read(self):
+        return self.body
+
+
+class HttpTransport():
+
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+    MAX_REDIRECTS = 10
+    # bodies up to this size are drained instead of dropping the connection
+    MAX_DRAIN_SIZE = 64 * 1024
+
+    def __init__(self, user_agent, timeout=10, max_idle_per_host=4,
+                 max_active_per_host=None):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        # concurrent requests per host, unlimited if None
+        self.max_active_per_host = max_active_per_host
+        self.connections_opened = 0
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def request(self, url, method='GET', headers=None, read_body=True,
+                timeout=None, max_size=None):
+        # with max_size only the head of larger bodies is read, read_body
+        # may also be a function of the response headers
+        for i in xrange(self.MAX_REDIRECTS + 1):
+            args = (url, method, headers, read_body, timeout or self.timeout,
+                    max_size)
+            slot = self._get_slot(url)
+            if slot is None:
+                status, reason, response_headers, body = self._request(*args)
+            else:
+                with slot:
+                    status, reason, response_headers, body = self._request(
+                        *args
+                    )
+            location = response_headers.get('location')
+            if status in self.REDIRECT_CODES and location:
+                url = urljoin(url, location)
+                if status == 303:
+                    method = 'GET'
+                continue
+            if status >= 400:
+                raise HTTPStatusError(url, status, reason)
+            return Response(url, status, response_headers, body)
+        raise TransportError('Too many redirects (%s)' % url)
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for conn in connections:
+                    conn.close()
+            self._idle.clear()
+
+    def _request(self, url, method, headers, read_body, timeout, max_size):
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if scheme not in ('http', 'https'):
+            raise TransportError('Unsupported url scheme (%s)' % url)
+        host_key = (scheme, netloc.lower())
+        if query:
+            path = '%s?%s' % (path, query)
+        request_headers = {
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'gzip',
+        }
+        request_headers.update(headers or {})
+        conn, reused = self._get_connection(host_key)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        try:
+            try:
+                conn.request(method, path or '/', headers=request_headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error), error:
+                # the server may have dropped an idle keep-alive connection
+                conn.close()
+                if not reused or isinstance(error, socket.timeout):
+                    raise
+                conn, reused = self._new_connection(host_key), False
+                conn.timeout = timeout
+                conn.request(method, path or '/', headers=request_headers)
+                response = conn.getresponse()
+            response_headers = dict(
+                (k.lower(), v) for k, v in response.getheaders()
+            )
+            if callable(read_body):
+                read_body = read_body(response_headers)
+            body = ''
+            if (read_body and max_size is not None and
+                    not self._fits(response_headers, max_size)):
+                body = self._decode(response.read(max_size), response_headers)
+                # the rest of the body is dropped with the connection
+                conn.close()
+            elif (read_body or method == 'HEAD' or
+                    self._is_drainable(response, response_headers)):
+                body = self._decode(response.read(), response_headers)
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._put_connection(host_key, conn)
+            else:
+                conn.close()
+        except (httplib.HTTPException, socket.error, IOError,
+                zlib.error), error:
+            conn.close()
+            if isinstance(error, socket.timeout):
+                raise TransportTimeoutError('%s (%s)' % (error, url))
+            raise TransportError('%s (%s)' % (error, url))
+        return response.status, response.reason, response_headers, body
+
+    def _is_drainable(self, response, headers):
+        if response.status in self.REDIRECT_CODES:
+            return True
+        return self._fits(headers, self.MAX_DRAIN_SIZE)
+
+    @staticmethod
+    def _fits(headers, size):
+        try:
+            return int(headers['content-length']) <= size
+        except (KeyError, ValueError):
+            return False
+
+    @staticmethod
+    def _decode(body, headers):
+        if headers.get('content-encoding') == 'gzip':
+            # decompressobj also copes with a truncated body
+            body = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body)
+        return body
+
+    def _get_slot(self, url):
+        if self.max_active_per_host is None:
+            return None
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.Semaphore(
+                    self.max_active_per_host
+                )
+            return self._slots[host]
+
+    def _get_connection(self, host_key):
+        with self._lock:
+            connections = self._idle.get(host_key)
+            if connections:
+                return connections.pop(), True
+        return self._new_connection(host_key), False
+
+    def _put_connection(self, host_key, conn):
+        with self._lock:
+            connections = self._idle.setdefault(host_key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def _new_connection(self, host_key):
+        scheme, netloc = host_key
+        if scheme == 'https':
+            conn_class = httplib.HTTPSConnection
+        else:
+            conn_class = httplib.HTTPConnection
+        with self._lock:
+            self.connections_opened += 1
+        return conn_class(netloc, timeout=self.timeout)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#     Copyright (C) 2012 Tristan Fischer (sphere@dersphere.de)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import time
+import traceback
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+
+from resources.lib.api import RadioApi
+from resources.lib.artwork import ArtworkCache
+from resources.lib.breaker import CircuitBreaker
+from resources.lib.cache import Cache
+from resources.lib.errors import RadioApiError
+from resources.lib.favourites import MyStations
+from resources.lib.index import StationIndex
+from resources.lib.nowplaying import NowPlayingPoller
+from resources.lib.sync import CatalogueSync
+from resources.lib.transport import HttpTransport
+
+ADDON_ID = 'plugin.audio.radio_de'
+LANGUAGES = ('english', 'german', 'french')
+# leave the network to kodi while it is starting up
+STARTUP_DELAY = 60
+# settings and the player are checked at least this often
+IDLE_DELAY = 30
+HOME_WINDOW = 10000
+# categories harvested into the local search index per sync run
+INDEX_CATEGORIES = 20
+ACTIVE_STATION = '%s.active_station' % ADDON_ID
+ACTIVE_URL = '%s.active_url' % ADDON_ID
+NOW_PLAYING = '%s.now_playing.%%s' % ADDON_ID
+MY_STATIONS_LISTED = '%s.my_stations_listed' % ADDON_ID
+# favourites are polled this long after my stations were listed
+FAVOURITES_TIMEOUT = 10 * 60
+
+
+def log(text):
+    xbmc.log('%s service: %s' % (ADDON_ID, text))
+
+
+def wait(seconds):
+    # returns True once kodi is shutting down
+    if hasattr(xbmc, 'Monitor') and hasattr(xbmc.Monitor, 'waitForAbort'):
+        return xbmc.Monitor().waitForAbort(seconds)
+    end = time.time() + seconds
+    while not xbmc.abortRequested and time.time() < end:
+        xbmc.sleep(500)
+    return xbmc.abortRequested
+
+
+def is_aborted():
+    if hasattr(xbmc, 'Monitor') and hasattr(xbmc.Monitor, 'abortRequested'):
+        return xbmc.Monitor().abortRequested()
+    return xbmc.abortRequested
+
+
+def get_storage_path():
+    # the same storage the xbmcswift2 plugin uses
+    storage_path = xbmc.translatePath(
+        'special://profile/addon_data/%s/.storage/' % ADDON_ID
+    )
+    if not os.path.isdir(storage_path):
+        os.makedirs(storage_path)
+    return storage_path
+
+
+def configure(radio_api, addon):
+    radio_api.set_language(LANGUAGES[int(addon.getSetting('language') or 0)])
+    radio_api.set_timeout(int(addon.getSetting('network_timeout') or 10))
+    radio_api.log = log
+
+
+def get_active_station():
+    # set by the plugin when it resolves a stream url
+    window = xbmcgui.Window(HOME_WINDOW)
+    player = xbmc.Player()
+    if (player.isPlayingAudio() and
+            player.getPlayingFile() == window.getProperty(ACTIVE_URL)):
+        return window.getProperty(ACTIVE_STATION)
+    return None
+
+
+def is_my_stations_listed():
+    # set by the plugin whenever it lists my stations
+    listed = xbmcgui.Window(HOME_WINDOW).getProperty(MY_STATIONS_LISTED)
+    try:
+        return time.time() - int(listed) < FAVOURITES_TIMEOUT
+    except ValueError:
+        return False
+
+
+def get_favourite_ids(storage_path):
+    my_stations = MyStations(os.path.join(storage_path, 'my_stations.db'))
+    return [
+        station_id for station_id, station in my_stations.items()
+        if not station.get('is_custom', False)
+    ]
+
+
+def run_step(func, *args):
+    # a failing step is logged and tried again on the next run, it must
+    # not stop the other steps or the service
+    try:
+        func(*args)
+    except Exception:
+        log('%s failed:\n%s' % (func.__name__, traceback.format_exc()))
+
+
+def sync_catalogue(sync):
+    num_requests = sync.run(wait)
+    log('sync run finished after %d requests' % num_requests)
+
+
+def fetch_artwork(artwork, radio_api, storage_path):
+    # logos of the favourites and of the top lists
+    my_stations = MyStations(os.path.join(storage_path, 'my_stations.db'))
+    urls = [station.get('thumbnail') for station in my_stations.values()]
+    for get_stations in (radio_api.get_top_stations,
+                         radio_api.get_recommendation_stations):
+        try:
+            urls.extend(station['thumbnail'] for station in get_stations())
+        except RadioApiError, error:
+            log('artwork of the top lists skipped: %s' % error)
+            break
+    num_fetched = artwork.fetch(urls, should_stop=is_aborted)
+    log('artwork fetched for %d logos' % num_fetched)
+
+
+def refresh_index(radio_api, storage_path):
+    # same file name as the plugin reads it from
+    index = StationIndex(os.path.join(
+        storage_path, 'stations_%s.db' % radio_api.language
+    ))
+    num_refreshed = index.refresh(radio_api, INDEX_CATEGORIES, wait)
+    log('index refreshed for %d categories' % num_refreshed)
+
+
+def poll_now_playing(poller, storage_path):
+    # nobody looks at the tracks unless a station plays or my stations
+    # were listed recently
+    favourite_ids = []
+    if is_my_stations_listed():
+        favourite_ids = get_favourite_ids(storage_path)
+    poller.set_stations(get_active_station(), favourite_ids)
+    poller.poll()
+
+
+def publish(station_id, track):
+    log('now playing on station %s: %s' % (station_id, track))
+    xbmcgui.Window(HOME_WINDOW).setProperty(NOW_PLAYING % station_id, track)
+    if station_id != get_active_station():
+        return
+    player = xbmc.Player()
+    try:
+        item = player.getPlayingItem()
+        item.setInfo('music', {'comment': track})
+        player.updateInfoTag(item)
+    except (AttributeError, RuntimeError):
+        # not supported by older kodi versions, the property is set anyway
+        pass
+
+
+def main():
+    storage_path = get_storage_path()
+    cache_path = os.path.join(storage_path, 'api_cache.db')
+    sync_api = RadioApi(cache=Cache(cache_path))
+    sync = CatalogueSync(sync_api, Cache(cache_path, table='visits'))
+    artwork = ArtworkCache(os.path.join(storage_path, 'artwork'),
+                           HttpTransport(RadioApi.USER_AGENT))
+    artwork.log = log
+    # the poller needs current data, so it bypasses the cache
+    poller = NowPlayingPoller(RadioApi(), publish)
+    # the index keeps the stations itself, its harvest would only push the
+    # browsed lists out of the api cache
+    index_api = RadioApi()
+    # shared with the plugin, which stops asking a failing api as well
+    sync_api.breaker = CircuitBreaker(Cache(cache_path, table='breakers'))
+    index_api.breaker = poller.radio_api.breaker = sync_api.breaker
+    next_sync = time.time() + STARTUP_DELAY
+    delay = STARTUP_DELAY
+    while not wait(delay):
+        # settings are read again for every run, they may have changed
+        addon = xbmcaddon.Addon(ADDON_ID)
+        if time.time() >= next_sync:
+            configure(sync_api, addon)
+            if addon.getSetting('background_sync') == 'true':
+                run_step(sync_catalogue, sync)
+            if addon.getSetting('local_search') == 'true':
+                configure(index_api, addon)
+                run_step(refresh_index, index_api, storage_path)
+            if addon.getSetting('cache_artwork') == 'true':
+                run_step(fetch_artwork, artwork, sync_api, storage_path)
+            next_sync = time.time() + sync.next_delay()
+        if addon.getSetting('now_playing') == 'true':
+            configure(poller.radio_api, addon)
+            run_step(poll_now_playing, poller, storage_path)
+        else:
+            poller.set_stations(None, [])
+        delays = [next_sync - time.time(), IDLE_DELAY, poller.next_delay()]
+        delay = max(min(d for d in delays if d is not None), 1)
+
+
+if __name__ == '__main__':
+    main()